@@ -0,0 +1,80 @@
+"""Benchmark the start up time of the nla command, i.e. the time to import nla_client.nla, and check that
+   importing it does not import requests or read the configuration.
+
+   python benchmarks/bench_startup.py [--repeat N] [--max-ms MS]
+
+   Exits with status 1 if a heavy module is imported at start up, or the median start up time is over MS."""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+#: modules which should not be imported until a call is made to the NLA server
+DEFERRED_MODULES = ("requests", "urllib3", "configparser", "sqlite3", "aiohttp")
+
+_CHECK = """
+import sys
+import nla_client.nla
+print(" ".join(m for m in %r if m in sys.modules))
+""" % (DEFERRED_MODULES,)
+
+
+def startup_times(repeat, env):
+    """Run a new interpreter which imports nla_client.nla `repeat` times, returning the wall times in seconds."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", "import nla_client.nla"], env=env)
+        times.append(time.perf_counter() - start)
+    return times
+
+def baseline_times(repeat, env):
+    """The wall times of starting an interpreter which imports nothing, to subtract from the start up times."""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", "pass"], env=env)
+        times.append(time.perf_counter() - start)
+    return times
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def run(repeat=20):
+    """Return a dictionary of the start up benchmark results."""
+    env = dict(os.environ)
+    # no USER must not stop the nla command starting
+    env.pop("USER", None)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+                                        [p for p in [env.get("PYTHONPATH")] if p])
+    imported = subprocess.check_output([sys.executable, "-c", _CHECK], env=env).decode().split()
+    interpreter = median(baseline_times(repeat, env))
+    startup = median(startup_times(repeat, env))
+    return {"startup_ms": 1000 * startup,
+            "import_ms": 1000 * max(startup - interpreter, 0),
+            "deferred_modules_imported": imported}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if importing nla_client.nla takes longer")
+    args = parser.parse_args()
+
+    result = run(args.repeat)
+    print("nla start up:        %.1f ms" % result["startup_ms"])
+    print("import nla_client:   %.1f ms" % result["import_ms"])
+    failed = False
+    if result["deferred_modules_imported"]:
+        print("FAIL: imported at start up: %s" % " ".join(result["deferred_modules_imported"]))
+        failed = True
+    if args.max_ms is not None and result["import_ms"] > args.max_ms:
+        print("FAIL: import took longer than %.1f ms" % args.max_ms)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
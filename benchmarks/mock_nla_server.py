@@ -0,0 +1,342 @@
+"""A local stand-in for the NLA server, implementing the parts of the REST-style API used by `nla_client_lib`:
+
+   - GET /api/v1/files?match=&stages=[&offset=&limit=]
+   - POST /api/v1/requests
+   - GET and PUT /api/v1/requests/<id>
+   - GET /api/v1/quota/<user>
+
+   and GET /_stats, which returns the number of calls and bytes served, for benchmarks.
+
+   As a web server in front of the real one would, GET responses other than file listings carry an ETag, are
+   answered with 304 Not Modified if the client sends the same ETag in If-None-Match, and are gzip compressed if
+   the client accepts it.
+
+   The catalogue is synthetic: `files` paths spread over the days from 2000 to 2019, in the stages **U**, **D** and
+   **T** to start with.  Requested files move from **T** through **A** (restoring) to **R** (restored) over time:
+   a request is started by "StorageD" `queue_delay` seconds after it is made, and its files are restored at
+   `restore_rate` files per second.  When a request's retention date passes, its files go back to **T** and the
+   request disappears.  Latency and errors can be injected into every call.
+
+   python benchmarks/mock_nla_server.py --files 1000000 --port 8001
+   NLA_SERVER_URL=http://localhost:8001/nla_control nla ls 2015/01/01
+"""
+
+import re
+import sys
+import gzip
+import json
+import hashlib
+import time
+import random
+import datetime
+import argparse
+import threading
+from array import array
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#: url prefix of the api, as on the real server
+URL_PREFIX = "/nla_control"
+
+#: number of file records written to the response at a time when streaming a file listing
+WRITE_BATCH = 1000
+
+#: responses larger than this are gzip compressed, if the client accepts it (file listings are not compressed)
+GZIP_MIN_BYTES = 1024
+
+
+class Catalogue(object):
+    """The state of the mock NLA system: files, their stages, requests and quotas."""
+
+    def __init__(self, files=100000, seed=1, queue_delay=5.0, restore_rate=100.0, quota_size=10 ** 14):
+        rng = random.Random(seed)
+        self.paths = []
+        self.sizes = array("q")
+        self.stages = bytearray()
+        start = datetime.date(2000, 1, 1)
+        for i in range(files):
+            day = start + datetime.timedelta(days=i * 7300 // files)     # spread over 20 years
+            self.paths.append("/badc/mock/data/%s/%04i/%02i/%02i/mock_%08i.nc" %
+                              ("abc"[i % 3], day.year, day.month, day.day, i))
+            self.sizes.append(rng.randint(1, 2 * 1024 ** 3))
+            self.stages.append(ord(rng.choice("UDTTTTTTTT")))
+        self.index = dict((p, i) for i, p in enumerate(self.paths))
+        self.verified = "2020-01-01T00:00:00"
+        self.queue_delay = queue_delay
+        self.restore_rate = restore_rate
+        self.quota_size = quota_size
+        self.requests = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def record(self, i):
+        return {"path": self.paths[i], "stage": chr(self.stages[i]), "size": self.sizes[i], "verified": self.verified}
+
+    def match(self, match, stages):
+        """The indexes of the files containing `match` at one of `stages`."""
+        stage_codes = set(stages.encode())
+        paths = self.paths
+        file_stages = self.stages
+        return [i for i in range(len(paths)) if match in paths[i] and file_stages[i] in stage_codes]
+
+    def used(self, user):
+        return sum(r["size"] for r in self.requests.values() if r["quota"] == user)
+
+    def advance(self):
+        """Move the requests and their files on to where they should be by now."""
+        now = time.time()
+        today = datetime.date.today().isoformat()
+        for req_id, req in list(self.requests.items()):
+            if req["retention"] < today:
+                for i in req["indexes"]:
+                    if self.stages[i] in b"AR":
+                        self.stages[i] = ord("T")
+                del self.requests[req_id]
+                continue
+            started = req["made"] + self.queue_delay
+            if now < started or "storaged_request_end" in req:
+                continue
+            if "storaged_request_start" not in req:
+                req["storaged_request_start"] = _timestamp(started)
+                for i in req["to_restore"]:
+                    self.stages[i] = ord("A")
+            restored = min(len(req["to_restore"]), int((now - started) * self.restore_rate))
+            for i in req["to_restore"][req["restored"]:restored]:
+                self.stages[i] = ord("R")
+            if restored > 0 and "first_files_on_disk" not in req:
+                req["first_files_on_disk"] = _timestamp(started + 1.0 / self.restore_rate)
+            req["restored"] = restored
+            if restored == len(req["to_restore"]):
+                finished = started + len(req["to_restore"]) / self.restore_rate
+                req["last_files_on_disk"] = _timestamp(finished)
+                req["storaged_request_end"] = _timestamp(finished)
+
+    def make_request(self, data):
+        user = data.get("quota")
+        if data.get("patterns"):
+            indexes = self.match(data["patterns"], "UDTAR")
+        else:
+            indexes = [self.index[p] for p in data.get("files", []) if p in self.index]
+        size = sum(self.sizes[i] for i in indexes)
+        if self.used(user) + size > self.quota_size:
+            return 403, {"error": "Quota full for user %s" % user}
+        req_id = self.next_id
+        self.next_id += 1
+        retention = data.get("retention") or (datetime.date.today() + datetime.timedelta(days=20)).isoformat()
+        self.requests[req_id] = {
+            "id": req_id, "quota": user, "retention": retention, "request_date": _timestamp(time.time()),
+            "request_patterns": data.get("patterns", ""), "notify_on_first_file": "", "notify_on_last_file": "",
+            "label": data.get("label") or data.get("patterns") or (self.paths[indexes[0]] if indexes else ""),
+            "indexes": indexes, "to_restore": [i for i in indexes if self.stages[i] == ord("T")],
+            "restored": 0, "size": size, "made": time.time()}
+        return 200, {"req_id": req_id}
+
+    def show_request(self, req_id):
+        req = self.requests[req_id]
+        info = dict((k, v) for k, v in req.items() if k not in ("indexes", "to_restore", "restored", "size", "made"))
+        info["files"] = [self.paths[i] for i in req["indexes"]]
+        return info
+
+    def quota(self, user):
+        requests = []
+        for req in self.requests.values():
+            if req["quota"] == user:
+                info = self.show_request(req["id"])
+                del info["files"]
+                requests.append(info)
+        return {"id": 1, "user": user, "email": "%s@example.com" % user, "notes": "", "size": self.quota_size,
+                "used": self.used(user), "requests": requests}
+
+
+def _timestamp(t):
+    return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class MockNLAHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _route(self, method):
+        server = self.server
+        # read the whole body first, so that it is not left on a kept-alive connection when the answer is an error
+        self.body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.stats_lock:
+            server.stats["calls"] += 1
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        path = url.path
+        if path == "/_stats":
+            return self._send(200, server.stats)
+        if not path.startswith(URL_PREFIX + "/api/v1/"):
+            return self._send(404, {"error": "Not found"})
+        if server.error_rate and random.random() < server.error_rate:
+            return self._send(503, {"error": "Injected error"})
+        path = path[len(URL_PREFIX):]
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        catalogue = server.catalogue
+        with catalogue.lock:
+            catalogue.advance()
+        if path == "/api/v1/files" and method == "GET":
+            # not under the lock, so that other calls are not held up by a long listing
+            return self._send_files(query)
+        with catalogue.lock:
+            if path == "/api/v1/requests" and method == "POST":
+                return self._send(*catalogue.make_request(self._read_json()))
+            m = re.match(r"^/api/v1/requests/(\d+)$", path)
+            if m:
+                req_id = int(m.group(1))
+                if req_id not in catalogue.requests:
+                    return self._send(404, {"error": "Request %s not found" % req_id})
+                if method == "GET":
+                    return self._send(200, catalogue.show_request(req_id))
+                if method == "PUT":
+                    data = self._read_json()
+                    for key in ("retention", "label", "notify_on_first_file", "notify_on_last_file"):
+                        if key in data:
+                            catalogue.requests[req_id][key] = data[key]
+                    return self._send(200, {"req_id": req_id})
+            m = re.match(r"^/api/v1/quota/([^/]+)$", path)
+            if m and method == "GET":
+                return self._send(200, catalogue.quota(m.group(1)))
+        return self._send(404, {"error": "Not found"})
+
+    def _read_json(self):
+        return json.loads(self.body.decode("utf-8") or "{}")
+
+    def _count(self, n):
+        with self.server.stats_lock:
+            self.server.stats["bytes"] += n
+
+    def _send(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        etag = None
+        if status == 200 and self.command == "GET":
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+            if self.headers.get("If-None-Match") == etag:
+                with self.server.stats_lock:
+                    self.server.stats["not_modified"] += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+        encoding = None
+        if len(body) > GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, 5)
+            encoding = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        self.wfile.write(body)
+        self._count(len(body))
+
+    def _send_files(self, query):
+        """Stream a file listing with chunked transfer encoding, as a large listing is on the real server."""
+        catalogue = self.server.catalogue
+        indexes = catalogue.match(query.get("match", ""), query.get("stages", "UDTAR"))
+        count = len(indexes)
+        if "limit" in query and self.server.paging:
+            offset = int(query.get("offset", 0))
+            indexes = indexes[offset:offset + int(query["limit"])]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(text):
+            data = text.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self._count(len(data))
+
+        write('{"count": %i, "files": [' % count)
+        for start in range(0, len(indexes), WRITE_BATCH):
+            records = ", ".join(json.dumps(catalogue.record(i)) for i in indexes[start:start + WRITE_BATCH])
+            write((", " if start else "") + records)
+        write("]}")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+
+class MockNLAServer(ThreadingHTTPServer):
+    """The mock NLA server.  Use start() to serve from a background thread, e.g. in a benchmark, and stop() to
+       shut it down.
+
+       :param Catalogue catalogue: the files and requests to serve
+       :param float latency: seconds added to every call
+       :param float error_rate: fraction of calls which fail with a 503 error
+       :param bool paging: support the offset and limit parameters when listing files
+    """
+    daemon_threads = True
+
+    def __init__(self, catalogue, host="localhost", port=0, latency=0.0, error_rate=0.0, paging=True,
+                 verbose=False):
+        ThreadingHTTPServer.__init__(self, (host, port), MockNLAHandler)
+        self.catalogue = catalogue
+        self.latency = latency
+        self.error_rate = error_rate
+        self.paging = paging
+        self.verbose = verbose
+        self.stats = {"calls": 0, "bytes": 0, "not_modified": 0}
+        self.stats_lock = threading.Lock()
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # clients closing pooled connections are not errors
+        if not issubclass(sys.exc_info()[0], ConnectionError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+    @property
+    def url(self):
+        return "http://%s:%s%s" % (self.server_address[0], self.server_address[1], URL_PREFIX)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A local stand-in for the NLA server.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--files", type=int, default=100000, help="number of files in the synthetic catalogue")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls which fail with 503")
+    parser.add_argument("--queue-delay", type=float, default=5.0, help="seconds before a request is started")
+    parser.add_argument("--restore-rate", type=float, default=100.0, help="files restored per second")
+    parser.add_argument("--no-paging", action="store_true", help="ignore offset and limit when listing files")
+    parser.add_argument("--verbose", action="store_true", help="log every call")
+    args = parser.parse_args()
+
+    catalogue = Catalogue(args.files, queue_delay=args.queue_delay, restore_rate=args.restore_rate)
+    server = MockNLAServer(catalogue, args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                           paging=not args.no_paging, verbose=args.verbose)
+    print("Mock NLA server with %i files at %s" % (args.files, server.url), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
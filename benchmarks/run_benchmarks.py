@@ -0,0 +1,204 @@
+"""Performance benchmarks for nla_client, run against the mock NLA server in mock_nla_server.py.
+
+   python benchmarks/run_benchmarks.py [--files N] [--only ls,submit,poll,startup] [--compare]
+
+   The benchmarks are:
+
+   - **ls**: time to the first file and throughput of iter_files, and ls, for a broad match, with the peak memory
+     used by the client for each
+   - **submit**: time to submit a large listing as chunked requests, with one and with several workers
+   - **poll**: calls and bytes used by wait_for_requests while a request is restored
+   - **startup**: start up time of the nla command (see bench_startup.py)
+
+   Each run is appended to a results file (benchmarks/results.jsonl by default), labelled with the package version
+   and git commit, and --compare shows the change in each result from the previous run.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import datetime
+import tracemalloc
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from nla_client import nla_client_lib, nla_client_bulk, nla_client_watch
+
+#: default file for the results of each run, one JSON object per line
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.jsonl")
+
+
+class MockServer(object):
+    """Run mock_nla_server.py in a separate process, so its memory and CPU use are not counted as the client's."""
+
+    def __init__(self, files, **options):
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        args = [sys.executable, os.path.join(BENCH_DIR, "mock_nla_server.py"), "--files", str(files),
+                "--port", str(self.port)]
+        for name, value in options.items():
+            args += ["--" + name.replace("_", "-"), str(value)]
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        self.process.stdout.readline()      # wait until the catalogue is made and the server is listening
+        self.url = "http://localhost:%i/nla_control" % self.port
+
+    def stats(self):
+        import requests
+        return requests.get("http://localhost:%i/_stats" % self.port).json()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def measure(function):
+    """Call `function`, returning its result, the wall time in seconds and the peak memory allocated in bytes."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+def bench_ls(files):
+    server = MockServer(files)
+    try:
+        client = nla_client_lib.NLAClient(server_url=server.url, quota_user="bench")
+        match = "/badc/mock/data/"      # every file
+        client.ls("no match", "UDTAR")  # open the connection
+
+        first = []
+        def stream():
+            start = time.perf_counter()
+            n = 0
+            for f in client.iter_files(match, "UDTAR"):
+                if n == 0:
+                    first.append(time.perf_counter() - start)
+                n += 1
+            return n
+        n, stream_time, stream_peak = measure(stream)
+        result, ls_time, ls_peak = measure(lambda: len(client.ls(match, "UDTAR")["files"]))
+        client.close()
+    finally:
+        server.stop()
+    return {"ls_files": n,
+            "iter_files_first_ms": 1000 * first[0],
+            "iter_files_s": stream_time,
+            "iter_files_per_s": n / stream_time,
+            "iter_files_peak_mb": stream_peak / 1024.0 ** 2,
+            "ls_s": ls_time,
+            "ls_per_s": result / ls_time,
+            "ls_peak_mb": ls_peak / 1024.0 ** 2}
+
+def bench_submit(files):
+    server = MockServer(files)
+    results = {}
+    try:
+        client = nla_client_lib.NLAClient(server_url=server.url, quota_user="bench")
+        paths = [f["path"] for f in client.iter_files("/badc/mock/data/", "T")]
+        for workers in (1, 4):
+            chunks, elapsed, peak = measure(lambda: nla_client_bulk.submit_listing(
+                paths, max_files=max(len(paths) // 20, 1), workers=workers, client=client))
+            failed = [c for c in chunks if c["status"] == "failed"]
+            results["submit_%i_workers_s" % workers] = elapsed
+            results["submit_%i_workers_failed" % workers] = len(failed)
+        results["submit_files"] = len(paths)
+        client.close()
+    finally:
+        server.stop()
+    return results
+
+def bench_poll(files, restore_rate=200.0):
+    server = MockServer(files, queue_delay=2, restore_rate=restore_rate)
+    try:
+        client = nla_client_lib.NLAClient(server_url=server.url, quota_user="bench")
+        paths = [f["path"] for f in client.iter_files("/badc/mock/data/a/", "T")][:int(restore_rate * 5)]
+        req_id = client.make_request(files=paths).json()["req_id"]
+        before = server.stats()
+        start = time.perf_counter()
+        outcome, requests = nla_client_watch.wait_for_requests([req_id], min_interval=0.5, max_interval=5,
+                                                               active_interval=2, client=client)
+        elapsed = time.perf_counter() - start
+        after = server.stats()
+        client.close()
+    finally:
+        server.stop()
+    return {"poll_outcome": outcome,
+            "poll_wait_s": elapsed,
+            "poll_calls": after["calls"] - before["calls"] - 1,     # the first stats call is counted
+            "poll_bytes": after["bytes"] - before["bytes"]}
+
+def bench_startup(files):
+    import bench_startup
+    return bench_startup.run(repeat=10)
+
+BENCHMARKS = {"ls": bench_ls, "submit": bench_submit, "poll": bench_poll, "startup": bench_startup}
+
+
+def version():
+    """The package version from setup.py, and the current git commit."""
+    with open(os.path.join(ROOT_DIR, "setup.py")) as fh:
+        m = re.search(r"version='([^']+)'", fh.read())
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return m.group(1) if m else None, commit
+
+def load_results(results_file):
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+def compare(previous, current):
+    """Print each result next to the same result from a previous run."""
+    print("%-30s %16s %16s %8s" % ("", "previous", "current", "change"))
+    for name, value in sorted(current["results"].items()):
+        old = previous["results"].get(name)
+        if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print("%-30s %16.4g %16.4g %+7.1f%%" % (name, old, value, 100.0 * (value - old) / old))
+        else:
+            print("%-30s %16s %16s" % (name, old, value))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=200000, help="number of files in the mock catalogue")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma separated benchmarks to run")
+    parser.add_argument("--results", default=RESULTS_FILE, help="file to append the results to")
+    parser.add_argument("--compare", action="store_true", help="compare with the previous run")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only.split(","):
+        print("running %s ..." % name, file=sys.stderr)
+        results.update(BENCHMARKS[name](args.files))
+    package_version, commit = version()
+    run = {"time": datetime.datetime.now().isoformat(), "version": package_version, "commit": commit,
+           "python": sys.version.split()[0], "files": args.files, "results": results}
+
+    previous = load_results(args.results)
+    with open(args.results, "a") as fh:
+        fh.write(json.dumps(run) + "\n")
+    if args.compare and previous:
+        compare(previous[-1], run)
+    else:
+        for name, value in sorted(results.items()):
+            print("%-30s %s" % (name, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,18 @@
 
 __author__ = 'sjp23'
 #
+import io
 import cmd
+import json
+import contextlib
 import nla_client.nla_client_lib as nla_client_lib
+from nla_client import nla_client_settings
 import sys
 import datetime
 
+#: exit status of wait when the command is not valid, distinct from its other outcomes
+WAIT_USAGE_ERROR = 3
+
 class nla_cmd(cmd.Cmd):
     """nla.py provides a command line interface to the NLA system that can be run from JASMIN.
 
@@ -18,6 +25,9 @@ class nla_cmd(cmd.Cmd):
     """
     prompt = "NLA>>> "
 
+    #: exit status of the last command that sets one, returned by the nla command when run non-interactively
+    exit_code = 0
+
     def do_ls(self, line):
         """List files in the NLA system.
 
@@ -36,23 +46,181 @@ class nla_cmd(cmd.Cmd):
 
           The rest of the arguments are a simple contains filter. e.g. for all files with 2015/12/04 in the path:
              ls 2015/12/04
+
+          If a local index is configured (NLA_INDEX_FILE) the listing is answered from it while it is fresh.
+          Use the -no-cache option to always fetch the listing from the NLA server.
+
+          Use the -summary option to show the number and total size of the files at each stage instead of the
+          files, or with -depth=N of the files under each directory N levels deep, as for du.
+
+          To list the files matching any of a list of patterns, with one listing from the NLA server, give a file
+          of patterns, one per line, with -patterns=FILE.  Each pattern is a substring, a glob matched against the
+          whole path if it contains any of *?[, or a regular expression if it starts with re:, e.g.
+             2015/12/04
+             */station_0[1-5]/*.nc
+             re:_(01|02)\.nc$
+          The number of files matching each pattern is shown after the listing.
              """
-        bits = line.strip().split()
-        match = ''
-        stages = "UDTAR"
+        options, match = self.parse_options(line, numbers=("depth",))
+        if options is None:
+            return
+        stages = options.get("stages", "UDTAR")
 
-        for b in bits:
-            if b[:8] == "-stages=":
-                stages = b[8:]
-            else:
-                match += " " + b
-        match = match.strip()
+        if "patterns" in options:
+            for path in self.match_patterns(options):
+                print(path)
+            return
 
-        filelist = nla_client_lib.ls(match, stages)
-        files = filelist["files"]
+        index = self.file_index()
+        if index is None:
+            files = nla_client_lib.iter_files(match, stages)
+        else:
+            files = index.iter_files(match, stages, no_cache=options.get("no-cache", False))
+        if options.get("summary", False):
+            # imported here, as it imports numpy if it is installed
+            from nla_client.nla_client_columns import FileTable
+            table = FileTable.from_files(files)
+            if "depth" in options:
+                self.print_totals(table.size_by_prefix(options["depth"]))
+            else:
+                self.print_totals(table.size_by_stage())
+            return
         for f in files:
             print(f["path"])
 
+    def do_du(self, line):
+        """Show the number and total size of files in the NLA system, by stage or by directory.
+
+          du 2015/12/04              totals for each stage of files with 2015/12/04 in the path
+          du -depth=3 2015/12/04     totals for each directory three levels deep, e.g. /badc/cmip5/data
+
+          The -stages= and -no-cache options are the same as for ls.  The totals are calculated using the local
+          index if one is configured (NLA_INDEX_FILE), or from the listing held in memory otherwise.
+        """
+        options, match = self.parse_options(line, numbers=("depth",))
+        if options is None:
+            return
+        stages = options.get("stages", "UDTAR")
+        no_cache = options.get("no-cache", False)
+
+        index = self.file_index()
+        if index is None:
+            from nla_client.nla_client_columns import FileTable
+            table = FileTable.from_files(nla_client_lib.iter_files(match, stages))
+            if "depth" in options:
+                rows = table.size_by_prefix(options["depth"])
+            else:
+                rows = table.size_by_stage()
+        elif "depth" in options:
+            rows = index.size_by_prefix(match, options["depth"], stages, no_cache=no_cache)
+        else:
+            rows = index.size_by_stage(match, stages, no_cache=no_cache)
+        self.print_totals(rows)
+
+    @staticmethod
+    def print_totals(rows):
+        """Print the (key, number of files, size) rows of du, and their total."""
+        total_files = 0
+        total_size = 0
+        for key, count, size in rows:
+            print("%-60s %10i files %16i bytes" % (key, count, size))
+            total_files += count
+            total_size += size
+        print("%-60s %10i files %16i bytes" % ("total", total_files, total_size))
+
+    @staticmethod
+    def show_pruned(pruned):
+        """Print the number of files removed from a request by prune_request, for each reason."""
+        print("Already on disk:      %i files" % len(pruned["on_disk"]))
+        print("Being restored:       %i files" % len(pruned["restoring"]))
+        print("Already requested:    %i files" % len(pruned["requested"]))
+        print("Not in the NLA:       %i files" % len(pruned["unknown"]))
+
+    @staticmethod
+    def dedupe(files=None, patterns=None):
+        """Remove files that do not need restoring from a request, reporting what was removed.  Returns the files
+        to request, or None if there are none or they do not fit in the remaining quota."""
+        from nla_client.nla_client_plan import prune_request
+        result = prune_request(files=files, patterns=patterns)
+        nla_cmd.show_pruned(result["pruned"])
+        print("To request:           %i files, %i bytes" % (len(result["files"]), result["size"]))
+        if not result["files"]:
+            print("Nothing to request.")
+            return None
+        if result["over_quota"]:
+            print("Request of %i bytes is larger than the remaining quota of %i bytes - not submitted." %
+                  (result["size"], result["quota_remaining"]))
+            return None
+        return result["files"]
+
+    #: options given on their own, as -name; all the other options need a value, as -name=value
+    FLAGS = ("no-cache", "summary", "dedupe", "bulk", "force", "dry-run", "v", "verbose")
+
+    def parse_options(self, line, numbers=()):
+        """Split a command line into a dictionary of options, given as -name=value or -name for the FLAGS, and the
+        remaining arguments joined into a single string.  The options named in `numbers` are converted to
+        integers.  If an option needs a value and has none, or one of `numbers` is not a whole number of at least
+        1, this is reported, the exit status set, and None, None returned."""
+        options = {}
+        args = []
+        for b in line.strip().split():
+            if b[:1] == "-" and len(b) > 1:
+                name, _, value = b.lstrip("-").partition("=")
+                if name in self.FLAGS:
+                    options[name] = True
+                elif not value:
+                    print("-%s needs a value, as -%s=VALUE" % (name, name))
+                    self.exit_code = 1
+                    return None, None
+                else:
+                    options[name] = value
+            else:
+                args.append(b)
+        for name in numbers:
+            if name in options:
+                try:
+                    options[name] = int(options[name])
+                except ValueError:
+                    options[name] = 0
+                if options[name] < 1:
+                    print("-%s= should be a whole number of at least 1" % name)
+                    self.exit_code = 1
+                    return None, None
+        return options, " ".join(args)
+
+    def match_patterns(self, options):
+        """Find the files matching the patterns in the file given by the -patterns= option, using the local index
+        if one is configured.  The number of files matching each pattern is written to standard error, and the
+        paths matching any pattern are returned."""
+        from nla_client import nla_client_bulk
+        from nla_client.nla_client_match import MultiMatcher, read_patterns, match_files
+        stages = options.get("stages", "UDTAR")
+        listing = nla_client_bulk.open_listing(options["patterns"])
+        try:
+            matcher = MultiMatcher(read_patterns(listing))
+        finally:
+            if listing is not sys.stdin:
+                listing.close()
+        index = self.file_index()
+        files = None
+        if index is not None:
+            files = index.iter_files(matcher.server_filter(), stages, no_cache=options.get("no-cache", False))
+        by_pattern, matched = match_files(matcher, stages, files=files)
+        for pattern, paths in zip(matcher.patterns, by_pattern):
+            print("%-60s %10i files" % (pattern.text, len(paths)), file=sys.stderr)
+        print("%-60s %10i files" % ("any pattern", len(matched)), file=sys.stderr)
+        return matched
+
+    def file_index(self):
+        """Return the local file index, opening it on first use, or None if no index is configured."""
+        index_file = nla_client_settings.index_file()
+        if index_file is None:
+            return None
+        if getattr(self, "_file_index", None) is None:
+            from nla_client.nla_client_index import FileIndex
+            self._file_index = FileIndex(index_file)
+        return self._file_index
+
     def do_EOF(self, line):
         """Quit
         """
@@ -61,35 +229,185 @@ class nla_cmd(cmd.Cmd):
 
     def do_pattern_request(self, line):
         """Request files by matching the pattern string to a substring in the filename
+
+        With the -dedupe option, files which are already on disk or in one of your requests are left out, and the
+        request is only made, as a listing of the remaining files, if they fit in your remaining quota.
+
+        With -patterns=FILE, the files matching any of the patterns in FILE are requested, as a listing.  The
+        patterns are as for ls -patterns=FILE.
         """
+        options, pattern = self.parse_options(line)
+        if options is None:
+            return
         date = datetime.datetime.now() + datetime.timedelta(days=30)
         date = date.strftime("%Y-%m-%d")
-        response = nla_client_lib.make_request(patterns=line, retention=date)
-        print(response)
-        print(response.content)
+        if "patterns" in options:
+            files = self.match_patterns(options)
+            if not files:
+                print("No files match the patterns.")
+                return
+            if "dedupe" in options:
+                files = self.dedupe(files=files)
+                if not files:
+                    return
+            response = nla_client_lib.make_request(files=files, retention=date)
+        elif "dedupe" in options:
+            files = self.dedupe(patterns=pattern)
+            if not files:
+                return
+            response = nla_client_lib.make_request(files=files, retention=date)
+        else:
+            response = nla_client_lib.make_request(patterns=pattern, retention=date)
+        self.show_response(response, content=True)
 
     def do_listing_request(self, line):
         """Make a tape request from a file listing. The file paths should be one per line and absolute.
+        The listing can be gzipped (ending .gz), or - to read it from standard input.
+
+        Very large listings can be submitted in bulk, as several requests of a limited size sent concurrently:
+           listing_request -bulk files.txt.gz
+        with the options:
+           -chunk=N          at most N files in each request
+           -workers=N        send N requests at once
+           -resume=FILE      record the submitted requests in FILE.  Running the same command again only
+                             submits the parts of the listing that failed the first time.
+           -label=LABEL      label the requests LABEL (part 1), LABEL (part 2), ...
+
+        With the -dedupe option, files which are already on disk or in one of your requests are left out, and the
+        request is only made if the remaining files fit in your remaining quota.
         """
+        import os
+        from nla_client import nla_client_bulk
+        options, filename = self.parse_options(line, numbers=("chunk", "workers"))
+        if options is None:
+            return
+        state_file = options.get("resume")
+        if state_file is not None and (os.path.isdir(state_file) or
+                                       not os.path.isdir(os.path.dirname(os.path.abspath(state_file)))):
+            print("-resume= should name a file, in a directory which exists")
+            self.exit_code = 1
+            return
         date = datetime.datetime.now() + datetime.timedelta(days=30)
         date = date.strftime("%Y-%m-%d")
-        files = open(line).readlines()
-        files = list(map(str.strip, files))
-        response = nla_client_lib.make_request(files=files, retention=date)
-        print(response)
-        print(response.content)
+        label = options.get("label")
+        listing = nla_client_bulk.open_listing(filename)
+        try:
+            files = nla_client_bulk.iter_listing(listing)
+            if "dedupe" in options:
+                files = self.dedupe(files=list(files))
+                if not files:
+                    return
+            if not any(k in options for k in ("bulk", "chunk", "workers", "resume")):
+                response = nla_client_lib.make_request(files=list(files), retention=date, label=label)
+                self.show_response(response, content=True)
+                return
+            results = nla_client_bulk.submit_listing(files, retention=date, label=label,
+                                                     max_files=options.get("chunk"),
+                                                     workers=options.get("workers"), state_file=state_file)
+        finally:
+            if listing is not sys.stdin:
+                listing.close()
+        req_ids = []
+        failed = 0
+        for r in results:
+            if r["status"] == "failed":
+                failed += 1
+                print("part %i: %i files FAILED: %s" % (r["chunk"], r["files"], r["error"]))
+            else:
+                req_ids.append(r["req_id"])
+                print("part %i: %i files %s as request %s" % (r["chunk"], r["files"], r["status"], r["req_id"]))
+        print("Requests: %s" % " ".join(map(str, req_ids)))
+        if failed:
+            print("%i of %i parts failed." % (failed, len(results)))
+
+    def do_plan(self, line):
+        """Plan a set of requests too large for your remaining quota as batches which each fit in it, to request
+        one after another as the earlier requests expire.  Files already on disk or in one of your requests are
+        left out.  Files are grouped by directory, so each batch needs as few tapes as possible.
+
+           plan 2015/12              the files with 2015/12 in the path
+           plan -listing=FILE        the files listed in FILE, one per line
+           plan -patterns=FILE       the files matching any of the patterns in FILE, as for ls -patterns=FILE
+
+        with the options:
+           -max-size=BYTES     at most BYTES in each batch, instead of your remaining quota
+           -output=PREFIX      write the batches to PREFIX_001.txt, PREFIX_002.txt, ... (default nla_plan)
+           -force              replace the batch files of an earlier plan with the same PREFIX
+
+        Each batch can then be requested with listing_request PREFIX_001.txt, and so on.
+        """
+        import os
+        import glob
+        from nla_client import nla_client_bulk
+        from nla_client.nla_client_plan import plan_batches
+        options, pattern = self.parse_options(line, numbers=("max-size",))
+        if options is None:
+            return
+        max_size = options.get("max-size")
+        prefix = options.get("output", "nla_plan")
+        earlier = sorted(glob.glob(glob.escape(prefix) + "_[0-9][0-9][0-9].txt"))
+        if earlier and "force" not in options:
+            print("Batch files from an earlier plan exist: %s" % " ".join(earlier))
+            print("Use -output= for a different PREFIX, or -force to replace them.")
+            self.exit_code = 1
+            return
+        if "patterns" in options:
+            result = plan_batches(files=self.match_patterns(options), max_size=max_size)
+        elif "listing" in options:
+            listing = nla_client_bulk.open_listing(options["listing"])
+            try:
+                result = plan_batches(files=list(nla_client_bulk.iter_listing(listing)), max_size=max_size)
+            finally:
+                if listing is not sys.stdin:
+                    listing.close()
+        else:
+            result = plan_batches(patterns=pattern, max_size=max_size)
+
+        self.show_pruned(result["pruned"])
+        if result["too_large"]:
+            print("Larger than a batch:  %i files - left out" % len(result["too_large"]))
+        if result["max_size"] is not None:
+            print("Batch size:           %i bytes" % result["max_size"])
+        if earlier:
+            print("Replacing the batch files of an earlier plan: %s" % " ".join(earlier))
+            for filename in earlier:
+                os.remove(filename)
+        for n, batch in enumerate(result["batches"], 1):
+            filename = "%s_%03i.txt" % (prefix, n)
+            with open(filename, "w") as fh:
+                for path in batch["files"]:
+                    fh.write(path + "\n")
+            print("batch %i: %i files, %i bytes, %i directories -> %s" %
+                  (n, len(batch["files"]), batch["size"], batch["directories"], filename))
+        if not result["batches"]:
+            print("Nothing to request.")
 
     def do_requests(self, line):
         """List requests for current user.
+
+        With the -v option the status and number of files of each request are also shown.  The details of all the
+        requests are fetched at the same time.
         """
+        options, _ = self.parse_options(line)
+        if options is None:
+            return
         quota = nla_client_lib.list_requests()
         print("=== Requests info for %s ===" % quota["user"])
         print("Number of requests: %s" % len(quota["requests"]))
         print("Quota size:         %s" % quota["size"])
         print("Total request size: %s" % quota["used"])
         print("Requests:  ")
-        for req in quota["requests"]:
-            print(" {id:>6} {label:60}   [{retention}]".format(**req))
+        if "v" in options or "verbose" in options:
+            from nla_client.nla_client_async import show_requests
+            details = show_requests([req["id"] for req in quota["requests"]])
+            for req, request_info in zip(quota["requests"], details):
+                print(" {id:>6} {label:60}   [{retention}]".format(**req))
+                if request_info is not None:
+                    print("        %s, %i files" % (self.request_status(request_info),
+                                                   len(request_info.get("files", []))))
+        else:
+            for req in quota["requests"]:
+                print(" {id:>6} {label:60}   [{retention}]".format(**req))
 
     def do_quota(self, line):
         """Check amount of quota remaining"""
@@ -109,7 +427,7 @@ class nla_cmd(cmd.Cmd):
         if req_id is None:
             return
         setresponse = nla_client_lib.update_request(req_id, retention=extra_line)
-        print(setresponse)
+        self.show_response(setresponse)
 
     def do_expire(self, line):
         """Set a request as expired by setting the retention date to now.
@@ -119,7 +437,7 @@ class nla_cmd(cmd.Cmd):
             return
         setresponse = nla_client_lib.update_request(req_id,
                                                     retention=datetime.datetime.now().strftime("%Y-%m-%d"))
-        print(setresponse)
+        self.show_response(setresponse)
 
     def do_notify_first(self, line):
         """Set the email address to notify on the arrival of the first file from tape.
@@ -128,7 +446,7 @@ class nla_cmd(cmd.Cmd):
         if req_id is None:
             return
         setresponse = nla_client_lib.update_request(req_id, notify_first=extra_line)
-        print(setresponse)
+        self.show_response(setresponse)
 
     def do_notify_last(self, line):
         """Set the email address to notify on the arrival of the last file from tape.
@@ -137,7 +455,7 @@ class nla_cmd(cmd.Cmd):
         if req_id is None:
             return
         setresponse = nla_client_lib.update_request(req_id, notify_last=extra_line)
-        print(setresponse)
+        self.show_response(setresponse)
 
     def do_notify(self, line):
         """Set the email address to notify for the arrivals of both the first and last file from tape.
@@ -146,7 +464,7 @@ class nla_cmd(cmd.Cmd):
         if req_id is None:
             return
         setresponse = nla_client_lib.update_request(req_id, notify_first=extra_line, notify_last=extra_line)
-        print(setresponse)
+        self.show_response(setresponse)
 
     def do_label(self, line):
         """Add a label to a request.
@@ -156,23 +474,98 @@ class nla_cmd(cmd.Cmd):
         if req_id is None:
             return
         setresponse = nla_client_lib.update_request(req_id, label=extra_line)
-        print(setresponse)
+        self.show_response(setresponse)
+
+    def do_bulk(self, line):
+        """Make the same change to many requests at once.
+        NLA>>> bulk retain -ids=20-35,40 2024-01-31
+        sets the retention date of requests 20 to 35 and 40 to 31st January 2024.  The changes are:
+           bulk retain SELECTION DATE
+           bulk expire SELECTION
+           bulk notify SELECTION EMAIL
+           bulk notify_first SELECTION EMAIL
+           bulk notify_last SELECTION EMAIL
+           bulk label SELECTION LABEL
+        and the requests are selected by any combination of:
+           -ids=IDS          request ids and ranges of ids, e.g. 12,15-20
+           -label=REGEX      requests whose label matches the regular expression
+           -expiring=DAYS    requests whose retention date is within DAYS days
+        Use -dry-run to show the requests which would be changed, without changing them.
+        """
+        from nla_client import nla_client_bulk
+        options, args = self.parse_options(line)
+        if options is None:
+            return
+        action, _, value = args.partition(" ")
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        changes = {"retain": {"retention": value},
+                   "expire": {"retention": today},
+                   "notify": {"notify_first": value, "notify_last": value},
+                   "notify_first": {"notify_first": value},
+                   "notify_last": {"notify_last": value},
+                   "label": {"label": value}}
+        if action not in changes:
+            print("First argument needs to be one of %s" % ", ".join(sorted(changes)))
+            self.exit_code = 1
+            return
+        if action in ("retain", "label") and not value:
+            print("A value is needed for bulk %s" % action)
+            self.exit_code = 1
+            return
+        if not any(k in options for k in ("ids", "label", "expiring")):
+            print("Select the requests with -ids=, -label= or -expiring=")
+            self.exit_code = 1
+            return
+        try:
+            ids = nla_client_bulk.parse_id_selection(options["ids"]) if "ids" in options else None
+            expiring = int(options["expiring"]) if "expiring" in options else None
+            workers = int(options.get("workers", 0))
+        except ValueError:
+            print("-ids= should be request ids and ranges of ids, e.g. 12,15-20, and -expiring= and -workers= "
+                  "whole numbers")
+            self.exit_code = 1
+            return
+
+        quota = nla_client_lib.list_requests()
+        if quota is None:
+            print("Could not get the list of requests.")
+            self.exit_code = 1
+            return
+        selected = nla_client_bulk.select_requests(quota, ids=ids, label=options.get("label"),
+                                                   expiring_within=expiring)
+        if ids is not None:
+            unknown = ids - set(req["id"] for req in quota["requests"])
+            if unknown:
+                print("Not current request numbers: %s" % sorted(unknown))
+        if not selected:
+            print("No requests selected.")
+            return
+
+        results = nla_client_bulk.bulk_update([req["id"] for req in selected], dry_run="dry-run" in options,
+                                              workers=workers, **changes[action])
+        labels = dict((req["id"], req.get("label", "")) for req in selected)
+        failed = 0
+        for r in results:
+            print(" {:>6} {:60}   {}".format(r["req_id"], labels[r["req_id"]], r["status"]), r.get("error", ""))
+            if r["status"] == "failed":
+                failed += 1
+        print("%i requests %s, %i failed" % (len(results) - failed, results[0]["status"] if not failed
+                                             else "updated", failed))
+        self.exit_code = 1 if failed else 0
 
     def do_requested_files(self, line):
         """List the files in a request."""
-        req_id, extra_line = self.check_request_id(line)
+        req_id, request_info = self.fetch_request(line)
         if req_id is None:
             return
-        request_info = nla_client_lib.show_request(req_id)
         for f in request_info["files"]:
             print(f)
 
     def _show_request(self, line):
         """Show details of a request."""
-        req_id, extra_line = self.check_request_id(line)
+        req_id, request_info = self.fetch_request(line)
         if req_id is None:
             return
-        request_info = nla_client_lib.show_request(req_id)
         print(request_info)
         print("=== [%s] ===" % req_id)
         if "label" in request_info:
@@ -195,30 +588,177 @@ class nla_cmd(cmd.Cmd):
     # alias for show_requests
     do_req = _show_request
 
-    @staticmethod
-    def check_request_id(line):
-        """check the first element of a line is a valid request id."""
+    def do_progress(self, line):
+        """Show how much of each of your requests has been restored, how fast, and when it should be finished.
+        NLA>>> progress
+        shows all your current requests, or
+        NLA>>> progress 23 24
+        shows requests 23 and 24.
+
+        The rate is measured between runs of progress, so run it more than once, e.g. every few minutes.  The
+        first run for a request looks up every file in it; later runs only look up the files not yet on disk.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from nla_client import nla_client_watch
+        from nla_client.nla_client_settings import BULK_WORKERS
+        options, ids = self.parse_options(line)
+        if options is None:
+            return
+        try:
+            req_ids = [int(i) for i in ids.split()]
+        except ValueError:
+            print("Request ids should be integers.")
+            self.exit_code = 1
+            return
+        # one up to date request list, for the status of all the requests
+        quota = nla_client_lib.list_requests(max_age=0)
+        if not req_ids:
+            req_ids = [req["id"] for req in quota["requests"]] if quota is not None else []
+        if not req_ids:
+            print("No current requests.")
+            return
+
+        def progress(req_id):
+            try:
+                return nla_client_watch.request_progress(req_id, quota=quota)
+            except ValueError as e:
+                return {"id": req_id, "error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=BULK_WORKERS) as executor:
+            for p in executor.map(progress, req_ids):
+                if "error" in p:
+                    print("[%s] %s" % (p["id"], p["error"]))
+                    self.exit_code = 1
+                    continue
+                percent = 100.0 * p["restored_bytes"] / p["bytes"] if p["bytes"] else 100.0
+                print("[%s] %s: %i of %i files, %i of %i bytes (%.1f%%)" % (
+                    p["id"], p["status"], p["restored_files"], p["files"], p["restored_bytes"], p["bytes"],
+                    percent))
+                if p["bytes_per_second"] is not None:
+                    eta = "unknown" if p["eta"] is None else str(datetime.timedelta(seconds=int(p["eta"])))
+                    print("     %.1f files/s, %.1f MB/s, ETA %s" % (
+                        p["files_per_second"], p["bytes_per_second"] / 1024.0 ** 2, eta))
+                if p["missing"]:
+                    print("     %i files are not in the NLA system" % p["missing"])
+
+    def do_wait(self, line):
+        """Wait for one or more requests to be restored, checking their status with backoff between the checks.
+        NLA>>> wait 23 24
+        waits until all the files in requests 23 and 24 are on disk.  The options are:
+           -mode=all         wait for all the files of every request (default)
+           -mode=first       wait for the first file of every request
+           -mode=any         wait for the first file of any of the requests
+           -timeout=SECONDS  give up after SECONDS
+
+        When used as "nla wait ..." the exit status is 0 if the requests reached the stage, 1 if a request id is
+        not valid (e.g. the request has expired), 2 if the timeout was reached, or 3 if the command itself is
+        not valid (e.g. an unknown -mode=).
+        """
+        from nla_client import nla_client_watch
+        options, ids = self.parse_options(line)
+        if options is None:
+            self.exit_code = WAIT_USAGE_ERROR
+            return
+        try:
+            req_ids = [int(i) for i in ids.split()]
+        except ValueError:
+            print("Request ids should be integers.")
+            self.exit_code = 1
+            return
+        if not req_ids:
+            print("Arguments need to be one or more request ids.")
+            self.exit_code = WAIT_USAGE_ERROR
+            return
+        mode = options.get("mode", nla_client_watch.WAIT_ALL)
+        if mode not in nla_client_watch.WAIT_MODES:
+            print("-mode= should be one of %s" % ", ".join(nla_client_watch.WAIT_MODES))
+            self.exit_code = WAIT_USAGE_ERROR
+            return
+        try:
+            timeout = float(options["timeout"]) if "timeout" in options else None
+        except ValueError:
+            timeout = -1
+        if timeout is not None and not timeout >= 0:
+            print("-timeout= should be a number of seconds")
+            self.exit_code = WAIT_USAGE_ERROR
+            return
+        statuses = {}
+
+        def report(requests):
+            for req_id, request_info in sorted(requests.items()):
+                status = self.request_status(request_info) if request_info is not None else "Status: Not found"
+                if statuses.get(req_id) != status:
+                    statuses[req_id] = status
+                    print("%s [%s] %s" % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), req_id, status))
+
+        outcome, requests = nla_client_watch.wait_for_requests(req_ids, mode=mode,
+                                                               timeout=timeout, callback=report)
+        if outcome == nla_client_watch.WAIT_DONE:
+            self.exit_code = 0
+        elif outcome == nla_client_watch.WAIT_MISSING:
+            missing = [i for i, r in sorted(requests.items()) if r is None]
+            print("%s not current request numbers." % missing)
+            self.exit_code = 1
+        else:
+            print("Timed out.")
+            self.exit_code = 2
+
+    def check_request_id(self, line, validate=True):
+        """check the first element of a line is a valid request id.  The request list used to validate the id is
+        cached for a short time, so consecutive commands do not each fetch it from the server."""
         bits = line.strip().split()
         if len(bits) == 0:
             print("First argument needs to be a request id.")
+            self.exit_code = 1
             return None, None
         try:
             request_number = int(bits[0])
         except ValueError:
             print("%s not a valid request id - they should be integers. " % bits[0])
+            self.exit_code = 1
             return None, None
 
         # check in request list
+        if validate:
+            valids = nla_cmd.valid_request_ids()
+            if request_number not in valids:
+                print("%s is not a current request number. Valid ids are %s" % (request_number, valids))
+                self.exit_code = 1
+                return None, None
+
+        return request_number, " ".join(bits[1:])
+
+    @staticmethod
+    def valid_request_ids():
+        """the ids of the current user's requests."""
         quota = nla_client_lib.list_requests()
         valids = []
         if quota != None:
             for req in quota["requests"]:
                 valids.append(req["id"])
-        if request_number not in valids:
-            print("%s is not a current request number. Valid ids are %s" % (request_number, valids))
+        return valids
+
+    def fetch_request(self, line):
+        """check the first element of a line is a request id for one of the user's requests and return it with
+        the request details.  The details are fetched straight away, so a valid id costs one call to the server;
+        the request list is only fetched to report the valid ids when it is not."""
+        req_id, extra_line = self.check_request_id(line, validate=False)
+        if req_id is None:
+            return None, None
+        request_info = nla_client_lib.show_request(req_id)
+        user = nla_client_lib.get_client().user
+        if request_info is None or request_info.get("quota", user) != user:
+            print("%s is not a current request number. Valid ids are %s" % (req_id, nla_cmd.valid_request_ids()))
+            self.exit_code = 1
             return None, None
+        return req_id, request_info
 
-        return request_number, " ".join(bits[1:])
+    def show_response(self, response, content=False):
+        """print the response to a call which changes a request, and set the exit status if it failed."""
+        print(response)
+        if content:
+            print(response.content)
+        self.exit_code = 0 if response.status_code == 200 else 1
 
     @staticmethod
     def request_status(request_info):
@@ -231,15 +771,103 @@ class nla_cmd(cmd.Cmd):
              request_info["storaged_request_end"])
 
 
-def main():
-    C = nla_cmd()
+def run_batch(C, lines, json_output=False, keep_going=False):
+    """Run a sequence of commands in one process, sharing the connection to the NLA server and the cached
+    request list.  Blank lines and lines starting with # are skipped.
+
+    With json_output, the output of each command is captured and printed as a single JSON object per line, with
+    the keys "command", "exit_code", "output" and (if the command raised one) "error".  Unless keep_going, the
+    batch stops at the first command that fails.  Returns the exit status of the batch: that of the failing
+    command, or 0."""
+    status = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        C.exit_code = 0
+        error = None
+        stop = False
+        output = io.StringIO() if json_output else sys.stdout
+        with contextlib.redirect_stdout(output):
+            try:
+                C.onecmd(line)
+            except SystemExit:
+                stop = True     # quit
+            except Exception as e:
+                error = "%s: %s" % (type(e).__name__, e)
+                if not json_output:
+                    print(error)
+                C.exit_code = C.exit_code or 1
+        if json_output:
+            record = {"command": line, "exit_code": C.exit_code, "output": output.getvalue()}
+            if error is not None:
+                record["error"] = error
+            print(json.dumps(record))
+        if C.exit_code:
+            status = C.exit_code
+            if not keep_going:
+                break
+        if stop:
+            break
+    return status
 
-    # if arguments then just do one command
-    if len(sys.argv) > 1:
-        C.onecmd(" ".join(sys.argv[1:]))
-        sys.exit()
 
-    C.cmdloop("===========================\nCEDA Near line tape utility.\n")
+def main():
+    C = nla_cmd()
+    args = sys.argv[1:]
+
+    # options for the nla command itself come before the command
+    batch = None
+    json_output = False
+    keep_going = False
+    timings = False
+    timings_json = None
+    timings_prom = None
+    while args and args[0].startswith("--"):
+        option, _, value = args.pop(0).partition("=")
+        if option == "--batch":
+            batch = value or (args.pop(0) if args else "-")
+        elif option == "--json":
+            json_output = True
+        elif option == "--continue":
+            keep_going = True
+        elif option == "--timings":
+            timings = True
+        elif option == "--timings-json" and value:
+            timings_json = value
+        elif option == "--timings-prom" and value:
+            timings_prom = value
+        else:
+            print("Unknown option %s.  Options are --batch FILE, --json, --continue, --timings, "
+                  "--timings-json=FILE and --timings-prom=FILE" % option)
+            sys.exit(1)
+
+    call_timings = None
+    if timings or timings_json or timings_prom:
+        from nla_client.nla_client_metrics import CallTimings
+        call_timings = CallTimings()
+        nla_client_lib.get_client().add_hook(call_timings)
+
+    try:
+        # run the commands in a file, or standard input, one per line
+        if batch is not None:
+            lines = sys.stdin if batch == "-" else open(batch)
+            sys.exit(run_batch(C, lines, json_output, keep_going))
+
+        # if arguments then just do one command
+        if args:
+            C.onecmd(" ".join(args))
+            sys.exit(C.exit_code)
+
+        C.cmdloop("===========================\nCEDA Near line tape utility.\n")
+    finally:
+        if call_timings is not None:
+            if timings:
+                print(call_timings.summary(), file=sys.stderr)
+            if timings_json:
+                call_timings.write_json(timings_json)
+            if timings_prom:
+                call_timings.write_prometheus(timings_prom)
 
 
 if __name__ == "__main__":
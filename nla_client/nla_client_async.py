@@ -0,0 +1,217 @@
+"""nla_client_async.py provides an asyncio version of the calls in `nla_client_lib`, so that many calls to the NLA
+   system can be made concurrently, e.g. to show the details of all of a user's requests at once.
+
+   It requires the optional `aiohttp <https://docs.aiohttp.org/>`_ package, installed with::
+
+       pip install nla_client[async]
+"""
+
+import ssl
+import json
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from nla_client import nla_client_lib, nla_client_settings
+from nla_client.nla_client_lib import IDEMPOTENT_METHODS, RETRY_STATUS_CODES
+from nla_client.nla_client_settings import POOL_SIZE, TIMEOUT, MAX_RETRIES, BACKOFF_FACTOR, BULK_WORKERS
+
+#: maximum number of calls in progress at once for an AsyncNLAClient
+MAX_CONCURRENCY = 50
+
+
+class AsyncResponse(object):
+    """The response to a call which changes a request, returned by :meth:`AsyncNLAClient.make_request` and
+       :meth:`AsyncNLAClient.update_request`.  Like `requests.Response` it has a **status_code**, **reason**,
+       **content** and a **json()** method."""
+
+    def __init__(self, status_code, reason, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode("utf-8"))
+
+    def __repr__(self):
+        return "<AsyncResponse [%s]>" % self.status_code
+
+
+class AsyncNLAClient(object):
+    """An asyncio client for the NLA REST-style API.  The coroutines mirror the functions in `nla_client_lib`, and
+       share one pool of connections.  At most `max_concurrency` calls are in progress at once, however many
+       coroutines are started.  Idempotent calls are retried as for :class:`nla_client_lib.NLAClient`.
+
+       Use it as an async context manager, so that the connections are closed::
+
+           async with AsyncNLAClient() as client:
+               quota = await client.list_requests()
+               requests = await asyncio.gather(*[client.show_request(r["id"]) for r in quota["requests"]])
+
+       The parameters are as for :class:`nla_client_lib.NLAClient`, with:
+
+       :param integer max_concurrency: (`optional`) maximum number of calls in progress at once
+    """
+
+    def __init__(self, server_url=None, quota_user=None, verify=None, pool_size=None, timeout=None,
+                 max_retries=None, backoff_factor=None, max_concurrency=None):
+        if aiohttp is None:
+            raise ImportError("AsyncNLAClient requires the aiohttp package: pip install nla_client[async]")
+        self.server_url = server_url or nla_client_lib.baseurl or nla_client_settings.server_url()
+        self._user = quota_user or nla_client_lib.user
+        self.verify = verify if verify is not None else nla_client_settings.verify_cert()
+        self.pool_size = pool_size if pool_size is not None else POOL_SIZE
+        self.timeout = timeout if timeout is not None else TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else MAX_RETRIES
+        self.backoff_factor = backoff_factor if backoff_factor is not None else BACKOFF_FACTOR
+        self.max_concurrency = max_concurrency or MAX_CONCURRENCY
+        self._session = None
+        self._semaphore = None
+
+    def _ssl(self):
+        if self.verify is True:
+            return None
+        if self.verify is False:
+            return False
+        return ssl.create_default_context(cafile=self.verify)
+
+    def _timeout(self):
+        if isinstance(self.timeout, tuple):
+            connect, read = self.timeout
+            return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+
+    @property
+    def user(self):
+        """The user id of the quota to use, taken from the settings when it is first needed."""
+        if self._user is None:
+            self._user = nla_client_settings.quota_user()
+        return self._user
+
+    @user.setter
+    def user(self, value):
+        self._user = value
+
+    @property
+    def session(self):
+        """The pooled `aiohttp.ClientSession`, created on first use (inside the running event loop)."""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=self._ssl())
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout())
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """Close all the pooled connections to the server."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def backoff(self, attempt):
+        return random.uniform(0, self.backoff_factor * (2 ** attempt))
+
+    async def _request(self, method, path, params=None, data=None):
+        """Send a request to the server, retrying as :meth:`nla_client_lib.NLAClient._request`.  Returns an
+           :class:`AsyncResponse` with the whole body read."""
+        url = self.server_url + path
+        session = self.session
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    async with session.request(method, url, params=params, data=data) as response:
+                        content = await response.read()
+                        result = AsyncResponse(response.status, response.reason, content)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    raise
+            else:
+                if result.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return result
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    async def ls(self, match, stages):
+        """See :func:`nla_client_lib.ls`."""
+        response = await self._request("GET", "/api/v1/files", params={"match": match, "stages": stages})
+        return response.json()
+
+    async def make_request(self, patterns=None, retention=None, files=None, label=None):
+        """See :func:`nla_client_lib.make_request`."""
+        data = {"quota": self.user}
+        assert patterns is None or files is None, "Can't define request files from list and pattern."
+        if patterns:
+            data["patterns"] = patterns
+        if files:
+            data["files"] = files
+        if retention:
+            data["retention"] = retention
+        if label:
+            data["label"] = label
+        return await self._request("POST", "/api/v1/requests", data=json.dumps(data))
+
+    async def update_request(self, request_id, retention=None, label=None, notify_first=None, notify_last=None):
+        """See :func:`nla_client_lib.update_request`."""
+        data = {"quota": self.user}
+        if retention:
+            data["retention"] = retention
+        if label:
+            data["label"] = label
+        if notify_first is not None:
+            data["notify_on_first_file"] = notify_first
+        if notify_last is not None:
+            data["notify_on_last_file"] = notify_last
+        return await self._request("PUT", "/api/v1/requests/%s" % request_id, data=json.dumps(data))
+
+    async def list_requests(self):
+        """See :func:`nla_client_lib.list_requests`."""
+        response = await self._request("GET", "/api/v1/quota/%s" % self.user)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            return None
+
+    async def show_request(self, request_number):
+        """See :func:`nla_client_lib.show_request`."""
+        response = await self._request("GET", "/api/v1/requests/%s" % request_number)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            return None
+
+
+def show_requests(request_numbers, client=None):
+    """Fetch the information for many requests concurrently, as :func:`nla_client_lib.show_request`.  This uses an
+       :class:`AsyncNLAClient` if aiohttp is installed, otherwise a pool of threads sharing the default client.
+
+       :param List[integer] request_numbers: the unique integer identifiers of the requests
+       :param NLAClient client: (`optional`) the client whose settings (server, user, ...) to use, default is the
+                                shared client
+
+       :return: A list of the Dictionaries returned by `show_request`, in the same order as `request_numbers`
+       :rtype: List[Dictionary]
+    """
+    client = client or nla_client_lib.get_client()
+    if aiohttp is None:
+        with ThreadPoolExecutor(max_workers=BULK_WORKERS) as executor:
+            return list(executor.map(client.show_request, request_numbers))
+
+    async def fetch():
+        async with AsyncNLAClient(server_url=client.server_url, quota_user=client.user, verify=client.verify,
+                                  pool_size=client.pool_size, timeout=client.timeout,
+                                  max_retries=client.max_retries, backoff_factor=client.backoff_factor) as aclient:
+            return await asyncio.gather(*[aclient.show_request(n) for n in request_numbers])
+
+    return list(asyncio.run(fetch()))
@@ -0,0 +1,229 @@
+"""nla_client_bulk.py provides bulk operations on the NLA system built on the calls in `nla_client_lib`, such as
+   submitting a very large file listing as a number of smaller retrieval requests, or changing many requests at
+   once."""
+
+import re
+import sys
+import gzip
+import json
+import hashlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from nla_client import nla_client_lib
+from nla_client.nla_client_settings import CHUNK_FILES, CHUNK_BYTES, BULK_WORKERS
+
+
+def open_listing(filename):
+    """Open a file listing for reading as text: "-" is standard input and names ending in ".gz" are
+       decompressed as they are read.
+
+       :param string filename: path to the listing file
+       :rtype: file object"""
+    if filename == "-":
+        return sys.stdin
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt")
+    return open(filename)
+
+def iter_listing(lines):
+    """Iterate over the file paths in a listing, one per line, skipping blank lines.
+
+       :param lines: an iterable of lines, e.g. a file object
+       :rtype: Iterator[string]"""
+    for line in lines:
+        path = line.strip()
+        if path:
+            yield path
+
+def iter_chunks(paths, max_files=None, max_bytes=None):
+    """Split an iterable of file paths into lists of at most `max_files` paths, and at most (roughly) `max_bytes`
+       once encoded in the body of a request.  Only one chunk is held in memory at a time.
+
+       :rtype: Iterator[List[string]]"""
+    max_files = max_files or CHUNK_FILES
+    max_bytes = max_bytes or CHUNK_BYTES
+    chunk = []
+    size = 0
+    for path in paths:
+        path_size = len(path.encode("utf-8")) + 4      # quotes, comma and space in the JSON list
+        if chunk and (len(chunk) >= max_files or size + path_size > max_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(path)
+        size += path_size
+    if chunk:
+        yield chunk
+
+def _chunk_digest(chunk):
+    digest = hashlib.sha1()
+    for path in chunk:
+        digest.update(path.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+def _load_state(state_file):
+    try:
+        with open(state_file) as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {"chunks": {}}
+
+def _save_state(state_file, state):
+    with open(state_file, "w") as fh:
+        json.dump(state, fh, indent=1)
+
+def submit_listing(paths, retention=None, label=None, max_files=None, max_bytes=None, workers=None,
+                   state_file=None, client=None):
+    """Submit a (possibly very large) list of files as a number of retrieval requests, each containing a chunk of
+       the list.  The chunks are submitted concurrently by a bounded pool of workers, and the list is read as the
+       chunks are submitted rather than all at once.
+
+       If a `state_file` is given, the request id of each chunk that is submitted successfully is recorded in it.
+       Submitting the same listing again with the same state file and chunk sizes then only submits the chunks
+       that failed, or were not reached, the previous time.
+
+       :param Iterable[string] paths: the file paths to request, e.g. from :func:`iter_listing`
+       :param DateTime retention: (`optional`) time and date until when the files will remain in the restore area
+       :param string label: (`optional`) label for the requests, the chunk number is appended to it
+       :param integer max_files: (`optional`) maximum number of files in each request
+       :param integer max_bytes: (`optional`) maximum size of the file list in each request, in bytes
+       :param integer workers: (`optional`) number of requests to submit at once
+       :param string state_file: (`optional`) JSON file recording the chunks that have been submitted
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+
+       :return: A list of Dictionaries, one for each chunk in order, with the keys:
+
+                - **chunk** (`integer`): the number of the chunk, starting at 1
+                - **files** (`integer`): the number of files in the chunk
+                - **status** (`string`): "submitted", "skipped" (already submitted according to the state file)
+                  or "failed"
+                - **req_id** (`integer`): the id of the request created for the chunk, if not failed
+                - **error** (`string`): the reason the chunk failed, if it failed
+
+       :rtype: List[Dictionary]
+    """
+    client = client or nla_client_lib.get_client()
+    workers = workers or BULK_WORKERS
+    state = _load_state(state_file) if state_file else {"chunks": {}}
+    lock = threading.Lock()
+
+    def submit(number, chunk, digest):
+        chunk_label = "%s (part %i)" % (label, number) if label else None
+        result = {"chunk": number, "files": len(chunk)}
+        try:
+            response = client.make_request(files=chunk, retention=retention, label=chunk_label)
+        except Exception as e:
+            result.update(status="failed", error=str(e))
+            return result
+        if response.status_code != 200:
+            try:
+                error = response.json().get("error", response.reason)
+            except ValueError:
+                error = response.reason
+            result.update(status="failed", error="%s %s" % (response.status_code, error))
+            return result
+        result.update(status="submitted", req_id=response.json()["req_id"])
+        if state_file:
+            with lock:
+                state["chunks"][str(number)] = {"req_id": result["req_id"], "digest": digest}
+                _save_state(state_file, state)
+        return result
+
+    results = []
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for number, chunk in enumerate(iter_chunks(paths, max_files, max_bytes), 1):
+            digest = _chunk_digest(chunk)
+            done = state["chunks"].get(str(number))
+            if done and done["digest"] == digest:
+                results.append({"chunk": number, "files": len(chunk), "status": "skipped", "req_id": done["req_id"]})
+                continue
+            # limit the number of chunks waiting to be sent, so the listing is not all read into memory
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(f.result() for f in finished)
+            pending.add(executor.submit(submit, number, chunk, digest))
+        results.extend(f.result() for f in wait(pending).done)
+    results.sort(key=lambda r: r["chunk"])
+    return results
+
+def parse_id_selection(text):
+    """Parse a selection of request ids such as "12,15-20 31" into a set of integers.
+
+       :param string text: ids and inclusive ranges of ids, separated by commas or spaces
+       :rtype: Set[integer]"""
+    ids = set()
+    for bit in re.split(r"[,\s]+", text.strip()):
+        if not bit:
+            continue
+        start, _, end = bit.partition("-")
+        if end:
+            ids.update(range(int(start), int(end) + 1))
+        else:
+            ids.add(int(start))
+    return ids
+
+def _retention_date(req):
+    from dateutil.parser import parse
+    return parse(req["retention"]).date() if req.get("retention") else None
+
+def select_requests(quota, ids=None, label=None, expiring_within=None):
+    """Select requests from the result of `list_requests`.  A request is selected if it matches all of the given
+       criteria.
+
+       :param Dictionary quota: the result of `list_requests`
+       :param Set[integer] ids: (`optional`) the ids to select, e.g. from :func:`parse_id_selection`
+       :param string label: (`optional`) a regular expression to search for in the request labels
+       :param integer expiring_within: (`optional`) select requests with a retention date within this many days
+
+       :return: the selected "requests" Dictionaries
+       :rtype: List[Dictionary]"""
+    selected = quota["requests"]
+    if ids is not None:
+        selected = [req for req in selected if req["id"] in ids]
+    if label is not None:
+        pattern = re.compile(label)
+        selected = [req for req in selected if pattern.search(req.get("label") or "")]
+    if expiring_within is not None:
+        last_date = datetime.date.today() + datetime.timedelta(days=expiring_within)
+        selected = [req for req in selected
+                    if _retention_date(req) is not None and _retention_date(req) <= last_date]
+    return selected
+
+def bulk_update(request_ids, workers=None, dry_run=False, client=None, **fields):
+    """Update many retrieval requests in the same way, with the calls to `update_request` sent concurrently by a
+       bounded pool of workers.
+
+       :param List[integer] request_ids: the ids of the requests to update
+       :param integer workers: (`optional`) number of requests to update at once
+       :param bool dry_run: (`optional`) don't update anything, just report what would be updated
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+       :param fields: the changes to make, as the keyword arguments of `update_request`: `retention`, `label`,
+                      `notify_first` and `notify_last`
+
+       :return: A list of Dictionaries, one for each request in order, with the keys:
+
+                - **req_id** (`integer`): the id of the request
+                - **status** (`string`): "updated", "failed" or "dry run"
+                - **error** (`string`): the reason the update failed, if it failed
+
+       :rtype: List[Dictionary]
+    """
+    client = client or nla_client_lib.get_client()
+    if dry_run:
+        return [{"req_id": req_id, "status": "dry run"} for req_id in request_ids]
+
+    def update(req_id):
+        try:
+            response = client.update_request(req_id, **fields)
+        except Exception as e:
+            return {"req_id": req_id, "status": "failed", "error": str(e)}
+        if response.status_code != 200:
+            return {"req_id": req_id, "status": "failed", "error": "%s %s" % (response.status_code, response.reason)}
+        return {"req_id": req_id, "status": "updated"}
+
+    with ThreadPoolExecutor(max_workers=workers or BULK_WORKERS) as executor:
+        return list(executor.map(update, request_ids))
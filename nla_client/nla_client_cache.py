@@ -0,0 +1,110 @@
+"""nla_client_cache.py keeps the decoded JSON of responses from the NLA server, with their ETag and Last-Modified
+   headers, so that a client can ask the server whether a response has changed (with If-None-Match and
+   If-Modified-Since) instead of downloading it again.  If it has not, the server answers 304 Not Modified with no
+   body and the kept copy is used.  This makes polling a large request cost a few hundred bytes, not megabytes."""
+
+import os
+import gzip
+import json
+import atexit
+import threading
+from collections import OrderedDict
+
+from nla_client.nla_client_settings import HTTP_CACHE_ENTRIES
+
+#: version of the format of the cache file; a file with a different version is ignored
+CACHE_FILE_VERSION = 1
+
+
+class ResponseCache(object):
+    """A least recently used cache of responses, keyed by url.  It is safe to use from several threads.
+
+       :param integer max_entries: (`optional`) number of responses to keep
+       :param string filename: (`optional`) file to keep the responses in between runs.  The file is read when the
+                               cache is first used, and written when :meth:`save` is called or at exit, if any
+                               responses have been added.
+    """
+
+    def __init__(self, max_entries=None, filename=None):
+        self.max_entries = max_entries if max_entries is not None else HTTP_CACHE_ENTRIES
+        self.filename = os.path.expanduser(filename) if filename else None
+        self._entries = OrderedDict()       # url -> (etag, last modified, decoded JSON)
+        self._lock = threading.Lock()
+        self._loaded = filename is None
+        self._changed = False
+        self._save_at_exit = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        """Read the cache file, if there is one.  Called with the lock held."""
+        self._loaded = True
+        try:
+            with gzip.open(self.filename, "rt") as fh:
+                content = json.load(fh)
+        except (IOError, OSError, ValueError, EOFError):
+            return
+        if content.get("version") != CACHE_FILE_VERSION:
+            return
+        for url, etag, last_modified, data in content["entries"][-self.max_entries:]:
+            self._entries[url] = (etag, last_modified, data)
+
+    def get(self, url):
+        """The kept response for `url`, or None.
+
+           :return: the ETag and Last-Modified headers of the response, and its decoded JSON
+           :rtype: Tuple"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, response, data):
+        """Keep the decoded JSON of a response, if the response has an ETag or Last-Modified header to check it
+           against later.
+
+           :param string url: the url of the response
+           :param response: the `requests.Response`
+           :param data: the decoded JSON"""
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries[url] = (etag, last_modified, data)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._changed = True
+            if self.filename is not None and not self._save_at_exit:
+                atexit.register(self.save)
+                self._save_at_exit = True
+
+    def clear(self):
+        """Drop all the kept responses."""
+        with self._lock:
+            self._entries.clear()
+            self._loaded = True
+            self._changed = self.filename is not None
+
+    def save(self):
+        """Write the kept responses to the cache file, if there is one and they have changed.  The file is written
+           under a temporary name and renamed, so that another run never reads it half written."""
+        with self._lock:
+            if self.filename is None or not self._changed:
+                return
+            entries = [[url] + list(entry) for url, entry in self._entries.items()]
+            self._changed = False
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = "%s.%i.tmp" % (self.filename, os.getpid())
+        with gzip.open(tmp, "wt") as fh:
+            json.dump({"version": CACHE_FILE_VERSION, "entries": entries}, fh)
+        os.rename(tmp, self.filename)
@@ -0,0 +1,228 @@
+"""nla_client_columns.py provides a compact, column-oriented store for the file information returned by `ls` or
+   `iter_files`, for listings of millions of files.  Instead of one dictionary per file, the paths are stored as an
+   index into a list of unique directories plus the file names packed into a single buffer, and the stages, sizes
+   and verified dates are stored in packed arrays.  Totals by stage or directory, and filters on stage, size and
+   date, work on the arrays directly.  If numpy is installed it is used for these, otherwise they are done in
+   pure Python."""
+
+import math
+import datetime
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#: the stages of a file in the NLA system, in the order used for the stage codes
+STAGES = "UDTAR"
+
+_NAN = float("nan")
+
+
+def _timestamp(value):
+    """Seconds since the epoch of a verified date string, or NaN if there is no date."""
+    if not value:
+        return _NAN
+    try:
+        d = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil.parser import parse
+        d = parse(value)
+    return d.timestamp()
+
+
+class FileTable(object):
+    """The information about a set of files in the NLA system, stored by column.
+
+       Build one from the "files" Dictionaries of `ls` / `iter_files`, e.g.::
+
+           table = FileTable.from_files(nla_client_lib.iter_files("2015", "UDTAR"))
+           print(table.size_by_stage())
+           on_tape = table.select(stages="T", min_size=1024 ** 3)
+    """
+
+    def __init__(self):
+        self.dirs = []                      # unique directories, in order of first appearance
+        self._dir_ids = {}
+        self.dir_index = array("I")         # index into dirs for each file
+        self.name_offsets = array("Q", [0])  # start of each file name in names, plus the end of the last
+        self.names = bytearray()            # utf-8 file names, one after another
+        self.stages = bytearray()           # index into STAGES for each file
+        self.sizes = array("q")             # size in bytes, -1 if not known
+        self.verified = array("d")          # verified date in seconds since the epoch, NaN if not known
+
+    @classmethod
+    def from_files(cls, files):
+        """Make a table from an iterable of file Dictionaries, with the keys **path**, **stage**, **size** and
+           **verified** as returned by `ls`."""
+        table = cls()
+        for f in files:
+            table.append(f)
+        return table
+
+    def append(self, f):
+        """Add a file Dictionary to the table."""
+        directory, _, name = f["path"].rpartition("/")
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        self.dir_index.append(dir_id)
+        self.names += name.encode("utf-8")
+        self.name_offsets.append(len(self.names))
+        self.stages.append(STAGES.index(f.get("stage") or "U"))
+        size = f.get("size")
+        self.sizes.append(int(size) if size is not None else -1)
+        self.verified.append(_timestamp(f.get("verified")))
+
+    def __len__(self):
+        return len(self.dir_index)
+
+    def path(self, i):
+        """The logical path of file number `i`."""
+        name = self.names[self.name_offsets[i]:self.name_offsets[i + 1]].decode("utf-8")
+        return self.dirs[self.dir_index[i]] + "/" + name
+
+    def paths(self):
+        """Iterate over the logical paths of the files."""
+        for i in range(len(self)):
+            yield self.path(i)
+
+    def __iter__(self):
+        """Iterate over the files as Dictionaries, as returned by `ls`.  The verified date is an ISO format
+           string."""
+        for i in range(len(self)):
+            verified = self.verified[i]
+            yield {"path": self.path(i),
+                   "stage": STAGES[self.stages[i]],
+                   "size": self.sizes[i] if self.sizes[i] >= 0 else None,
+                   "verified": None if math.isnan(verified) else
+                   datetime.datetime.fromtimestamp(verified).isoformat()}
+
+    def total_size(self):
+        """Total size of the files in bytes."""
+        if numpy is not None:
+            sizes = numpy.frombuffer(self.sizes, dtype=numpy.int64)
+            return int(sizes[sizes > 0].sum())
+        return sum(s for s in self.sizes if s > 0)
+
+    def size_by_stage(self):
+        """Return the number of files and total size of the files in each stage.
+
+           :return: A list of (stage, number of files, total size in bytes) tuples, for the stages with files
+           :rtype: List[Tuple]"""
+        if numpy is not None:
+            stages = numpy.frombuffer(self.stages, dtype=numpy.uint8)
+            sizes = numpy.frombuffer(self.sizes, dtype=numpy.int64).clip(min=0)
+            counts = numpy.bincount(stages, minlength=len(STAGES))
+            # summed as integers: float weights (as with bincount) are inexact above 2**53 bytes
+            totals = numpy.zeros(len(STAGES), dtype=numpy.int64)
+            numpy.add.at(totals, stages, sizes)
+        else:
+            counts = [0] * len(STAGES)
+            totals = [0] * len(STAGES)
+            for stage, size in zip(self.stages, self.sizes):
+                counts[stage] += 1
+                if size > 0:
+                    totals[stage] += size
+        return [(STAGES[s], int(counts[s]), int(totals[s])) for s in range(len(STAGES)) if counts[s]]
+
+    def size_by_prefix(self, depth):
+        """Return the number of files and total size of the files under each directory `depth` levels deep, e.g.
+           /badc/cmip5 for depth 2.  A file less than `depth` levels deep is shown on its own, as by
+           :meth:`nla_client_index.FileIndex.size_by_prefix`.
+
+           :return: A list of (directory, number of files, total size in bytes) tuples, sorted by directory
+           :rtype: List[Tuple]"""
+        # totals for each unique directory first, then combine the directories with the same prefix
+        if numpy is not None:
+            dir_index = numpy.frombuffer(self.dir_index, dtype=numpy.uint32)
+            sizes = numpy.frombuffer(self.sizes, dtype=numpy.int64).clip(min=0)
+            counts = numpy.bincount(dir_index, minlength=len(self.dirs))
+            totals = numpy.zeros(len(self.dirs), dtype=numpy.int64)
+            numpy.add.at(totals, dir_index, sizes)
+        else:
+            counts = [0] * len(self.dirs)
+            totals = [0] * len(self.dirs)
+            for dir_id, size in zip(self.dir_index, self.sizes):
+                counts[dir_id] += 1
+                if size > 0:
+                    totals[dir_id] += size
+        prefixes = {}
+        shallow = set()
+        for dir_id, directory in enumerate(self.dirs):
+            bits = directory.split("/")
+            if len(bits) - 1 < depth:
+                shallow.add(dir_id)
+                continue
+            prefix = "/".join(bits[:depth + 1])
+            count, total = prefixes.get(prefix, (0, 0))
+            prefixes[prefix] = (count + int(counts[dir_id]), total + int(totals[dir_id]))
+        if shallow:
+            for i in range(len(self)):
+                if self.dir_index[i] in shallow:
+                    path = self.path(i)
+                    count, total = prefixes.get(path, (0, 0))
+                    prefixes[path] = (count + 1, total + max(self.sizes[i], 0))
+        return [(prefix, count, total) for prefix, (count, total) in sorted(prefixes.items())]
+
+    def select(self, stages=None, min_size=None, max_size=None, verified_after=None, verified_before=None):
+        """Return a new table of the files which match all the given criteria.
+
+           :param string stages: (`optional`) only files at these stages, any combination of **UDTAR**
+           :param integer min_size: (`optional`) only files of at least this size in bytes
+           :param integer max_size: (`optional`) only files of at most this size in bytes
+           :param DateTime verified_after: (`optional`) only files verified at or after this date
+           :param DateTime verified_before: (`optional`) only files verified before this date
+           :rtype: FileTable"""
+        after = verified_after.timestamp() if verified_after is not None else None
+        before = verified_before.timestamp() if verified_before is not None else None
+        if numpy is not None:
+            keep = numpy.ones(len(self), dtype=bool)
+            if stages is not None:
+                codes = [STAGES.index(s) for s in stages]
+                keep &= numpy.isin(numpy.frombuffer(self.stages, dtype=numpy.uint8), codes)
+            sizes = numpy.frombuffer(self.sizes, dtype=numpy.int64)
+            if min_size is not None:
+                keep &= sizes >= min_size
+            if max_size is not None:
+                keep &= (sizes <= max_size) & (sizes >= 0)
+            verified = numpy.frombuffer(self.verified, dtype=numpy.float64)
+            if after is not None:
+                keep &= verified >= after
+            if before is not None:
+                keep &= verified < before
+            indexes = numpy.flatnonzero(keep)
+        else:
+            codes = set(STAGES.index(s) for s in stages) if stages is not None else None
+            indexes = [i for i in range(len(self))
+                       if (codes is None or self.stages[i] in codes)
+                       and (min_size is None or self.sizes[i] >= min_size)
+                       and (max_size is None or 0 <= self.sizes[i] <= max_size)
+                       and (after is None or self.verified[i] >= after)
+                       and (before is None or self.verified[i] < before)]
+        return self.take(indexes)
+
+    def take(self, indexes):
+        """Return a new table of the files at the given positions in this one."""
+        table = FileTable()
+        # copy the directory list, so the directory indexes can be copied as they are
+        table.dirs = list(self.dirs)
+        table._dir_ids = dict(self._dir_ids)
+        offsets = self.name_offsets
+        for i in indexes:
+            table.names += self.names[offsets[i]:offsets[i + 1]]
+            table.name_offsets.append(len(table.names))
+        if numpy is not None:
+            indexes = numpy.asarray(indexes, dtype=numpy.intp)
+            table.dir_index = array("I", numpy.frombuffer(self.dir_index, dtype=numpy.uint32)[indexes].tobytes())
+            table.stages = bytearray(numpy.frombuffer(self.stages, dtype=numpy.uint8)[indexes].tobytes())
+            table.sizes = array("q", numpy.frombuffer(self.sizes, dtype=numpy.int64)[indexes].tobytes())
+            table.verified = array("d", numpy.frombuffer(self.verified, dtype=numpy.float64)[indexes].tobytes())
+        else:
+            table.dir_index = array("I", (self.dir_index[i] for i in indexes))
+            table.stages = bytearray(self.stages[i] for i in indexes)
+            table.sizes = array("q", (self.sizes[i] for i in indexes))
+            table.verified = array("d", (self.verified[i] for i in indexes))
+        return table
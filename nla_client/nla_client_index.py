@@ -0,0 +1,188 @@
+"""nla_client_index.py provides an optional local SQLite index of the file information returned by the NLA
+   `ls` call, so that repeated queries, and aggregate queries such as the total size of files by stage or by
+   directory, can be answered without going back to the NLA server each time."""
+
+import time
+import sqlite3
+
+from nla_client import nla_client_lib
+from nla_client.nla_client_settings import INDEX_TTL
+
+#: number of rows written to the index in each executemany call while refreshing
+REFRESH_BATCH_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    stage TEXT,
+    size INTEGER,
+    verified TEXT,
+    generation INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_stage ON files (stage);
+CREATE TABLE IF NOT EXISTS queries (
+    match TEXT PRIMARY KEY,
+    fetched REAL,
+    generation INTEGER
+);
+"""
+
+# trigram index on the paths, used for substring matches, if the SQLite library supports it (3.34+)
+_TRIGRAM_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS path_trigrams USING fts5(
+    path, content='files', content_rowid='rowid', tokenize='trigram case_sensitive 1'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO path_trigrams (rowid, path) VALUES (new.rowid, new.path);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO path_trigrams (path_trigrams, rowid, path) VALUES ('delete', old.rowid, old.path);
+END;
+"""
+
+
+def _path_prefix(path, depth):
+    """The first `depth` directories of `path`, e.g. _path_prefix("/badc/cmip5/data/x.nc", 2) is "/badc/cmip5"."""
+    bits = path.split("/")
+    return "/".join(bits[:depth + 1])
+
+
+class FileIndex(object):
+    """A local SQLite copy of the file information in the NLA system.
+
+       Each `ls` style query is answered from the index if a query which covers it (i.e. whose match string is a
+       substring of the new match string) has been fetched from the server within the last `ttl` seconds.
+       Otherwise the files for the query are streamed from the server and written into the index first.
+
+       :param string filename: the SQLite database file, or ":memory:" for an index which is not kept
+       :param integer ttl: (`optional`) number of seconds a query fetched from the server is considered fresh
+       :param NLAClient client: (`optional`) the client used to fetch from the server, default is the shared client
+    """
+
+    def __init__(self, filename, ttl=None, client=None):
+        self.filename = filename
+        self.ttl = ttl if ttl is not None else INDEX_TTL
+        self._client = client
+        self.db = sqlite3.connect(filename)
+        self.db.create_function("nla_prefix", 2, _path_prefix)
+        self.db.executescript(_SCHEMA)
+        try:
+            self.db.executescript(_TRIGRAM_SCHEMA)
+            self.trigrams = True
+        except sqlite3.OperationalError:
+            self.trigrams = False
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else nla_client_lib.get_client()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def covering_query(self, match):
+        """Return the match string of a fresh query that covers `match`, or None if there is not one."""
+        row = self.db.execute("SELECT match FROM queries WHERE fetched > ? AND instr(?, match) > 0 "
+                              "ORDER BY length(match) DESC LIMIT 1", (time.time() - self.ttl, match)).fetchone()
+        return row[0] if row else None
+
+    def refresh(self, match):
+        """Fetch all the files containing `match`, in all stages, from the server and bring the index up to date:
+           new and changed files are written, and files which have been removed from the NLA system are deleted.
+
+           :param string match: A pattern to match filenames against - i.e. does a filename contain this substring
+           :return: the number of files fetched
+           :rtype: integer
+        """
+        fetched = time.time()
+        generation = self.db.execute("SELECT coalesce(max(generation), 0) + 1 FROM queries").fetchone()[0]
+        upsert = ("INSERT INTO files (path, stage, size, verified, generation) VALUES (?, ?, ?, ?, ?) "
+                  "ON CONFLICT (path) DO UPDATE SET generation = excluded.generation, stage = excluded.stage, "
+                  "size = excluded.size, verified = excluded.verified")
+        count = 0
+        with self.db:
+            batch = []
+            for f in self.client.iter_files(match, "UDTAR"):
+                batch.append((f["path"], f.get("stage"), f.get("size"), f.get("verified"), generation))
+                if len(batch) >= REFRESH_BATCH_SIZE:
+                    self.db.executemany(upsert, batch)
+                    count += len(batch)
+                    batch = []
+            self.db.executemany(upsert, batch)
+            count += len(batch)
+            # anything matching which was not seen in this fetch is no longer in the NLA system
+            self.db.execute("DELETE FROM files WHERE generation < ? AND instr(path, ?) > 0", (generation, match))
+            self.db.execute("INSERT OR REPLACE INTO queries (match, fetched, generation) VALUES (?, ?, ?)",
+                            (match, fetched, generation))
+        return count
+
+    def ensure_fresh(self, match, no_cache=False):
+        """Refresh the index for `match` unless a fresh covering query already exists, or always if `no_cache`."""
+        if no_cache or self.covering_query(match) is None:
+            self.refresh(match)
+
+    def _where(self, match, stages, prefix):
+        """Build the FROM / WHERE clause and its parameters for a query of the files table."""
+        tables = "files"
+        clauses = []
+        params = []
+        if match:
+            if self.trigrams and len(match) >= 3:
+                tables = "files JOIN path_trigrams ON files.rowid = path_trigrams.rowid"
+                clauses.append("path_trigrams MATCH ?")
+                params.append('"%s"' % match.replace('"', '""'))
+            clauses.append("instr(files.path, ?) > 0")
+            params.append(match)
+        if stages and stages != "UDTAR":
+            clauses.append("files.stage IN (%s)" % ",".join("?" * len(stages)))
+            params.extend(stages)
+        if prefix:
+            # range on the primary key so that the index is used
+            clauses.append("files.path >= ? AND files.path < ?")
+            params.extend((prefix, prefix + u"\U0010ffff"))
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        return tables + where, params
+
+    def iter_files(self, match, stages, prefix=None, no_cache=False):
+        """Iterate over the files containing `match` in the given `stages`, refreshing from the server if needed.
+
+           :param string match: A pattern to match filenames against - i.e. does a filename contain this substring
+           :param string stages: any combination of **UDTAR**
+           :param string prefix: (`optional`) only files whose path starts with this prefix
+           :param bool no_cache: (`optional`) always refresh from the server first
+           :return: An iterator over the file Dictionaries, with the same keys as returned by `ls`
+           :rtype: Iterator[Dictionary]
+        """
+        self.ensure_fresh(match, no_cache)
+        sql, params = self._where(match, stages, prefix)
+        cursor = self.db.execute("SELECT files.path, files.stage, files.size, files.verified FROM " + sql +
+                                 " ORDER BY files.path", params)
+        for path, stage, size, verified in cursor:
+            yield {"path": path, "stage": stage, "size": size, "verified": verified}
+
+    def size_by_stage(self, match, stages="UDTAR", prefix=None, no_cache=False):
+        """Return the number of files and total size of the files in each stage.
+
+           :return: A list of (stage, number of files, total size in bytes) tuples
+           :rtype: List[Tuple]
+        """
+        self.ensure_fresh(match, no_cache)
+        sql, params = self._where(match, stages, prefix)
+        return self.db.execute("SELECT files.stage, count(*), coalesce(sum(files.size), 0) FROM " + sql +
+                               " GROUP BY files.stage ORDER BY files.stage", params).fetchall()
+
+    def size_by_prefix(self, match, depth, stages="UDTAR", prefix=None, no_cache=False):
+        """Return the number of files and total size of the files under each directory `depth` levels deep.
+
+           :return: A list of (directory, number of files, total size in bytes) tuples
+           :rtype: List[Tuple]
+        """
+        self.ensure_fresh(match, no_cache)
+        sql, params = self._where(match, stages, prefix)
+        return self.db.execute("SELECT nla_prefix(files.path, ?) AS dir, count(*), coalesce(sum(files.size), 0) "
+                               "FROM " + sql + " GROUP BY dir ORDER BY dir", [depth] + params).fetchall()
@@ -5,13 +5,574 @@
 __author__ = 'sjp23'
 
 import os
-import requests
+import re
+import time
+import codecs
+import random
 import json
 
-from nla_client.nla_client_settings import NLA_SERVER_URL, VERIFY_CERT
+from nla_client import nla_client_settings
+from nla_client.nla_client_settings import POOL_SIZE, TIMEOUT, MAX_RETRIES, BACKOFF_FACTOR, REQUEST_LIST_TTL, \
+    BULK_WORKERS, LOOKUP_MAX_CALLS, LOOKUP_MIN_DEPTH
+
+# requests is imported when the first call is made to the NLA server, so that importing this module (and starting
+# the nla command) is quick.
+
+#: the user id of the quota to use.  If None, it is taken from the settings (NLA_USER or USER) when a call first
+#: needs a quota.
+user = None
+
+#: the baseurl for the api to the NLA system.  If None, it is taken from the settings (NLA_SERVER_URL or the config
+#: file) when the default client is created.
+baseurl = None
+
+#: HTTP methods that can safely be sent again if the first attempt fails
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+#: HTTP status codes that indicate a transient server side failure worth retrying
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+#: size, in bytes, of the chunks read from a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRUCTURE = re.compile(r'[][{}",:]')
+_STRING_END = re.compile(r'["\\]')
+
+
+def _decode_chunks(chunks, encoding, counter=None):
+    """Decode an iterable of byte chunks to text chunks, adding the number of bytes to counter["bytes"] if a
+       counter is given."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for chunk in chunks:
+        if counter is not None:
+            counter["bytes"] += len(chunk)
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+class _ListStart(object):
+    """Finds the start of the list `key` in the top level object of a JSON document read in chunks.  Strings and
+       nested values are skipped over, so that the "files" list of {"meta": {"files": []}, "files": [...]} is the
+       second one, and only the part of the document not yet scanned is kept."""
+
+    def __init__(self, key):
+        self.key = key
+        self.buf = ""
+        self.scan = 0               # position in buf scanned up to
+        self.depth = 0
+        self.in_string = False
+        self.string_start = None    # position in buf of the opening quote of a string in the top level object
+        self.last_string = None     # the last string in the top level object, as written in the document
+        self.at_key = False         # the last string in the top level object was `key`, followed by ":"
+
+    def feed(self, text):
+        """Scan the next chunk of the document.  Once the start of the list has been found, return the rest of
+           the document after the "[", otherwise None."""
+        buf = self.buf + text
+        scan = self.scan
+        while True:
+            if self.in_string:
+                m = _STRING_END.search(buf, scan)
+                if m is None:
+                    scan = len(buf)
+                    break
+                if m.group() == "\\":
+                    if m.end() == len(buf):
+                        # the escaped character is in the next chunk
+                        scan = m.start()
+                        break
+                    scan = m.end() + 1
+                    continue
+                scan = m.end()
+                self.in_string = False
+                if self.depth == 1:
+                    self.last_string = buf[self.string_start:scan]
+                    self.string_start = None
+                continue
+            m = _STRUCTURE.search(buf, scan)
+            if m is None:
+                scan = len(buf)
+                break
+            c = m.group()
+            scan = m.end()
+            if c == "[" and self.at_key:
+                self.buf = ""
+                return buf[scan:]
+            if c == ":":
+                self.at_key = self.depth == 1 and self.last_string is not None and \
+                    json.loads(self.last_string) == self.key
+            else:
+                self.at_key = False
+            if c == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.string_start = m.start()
+            elif c in "[{":
+                self.depth += 1
+            elif c in "]}":
+                self.depth -= 1
+        # keep only the string being read, if it could be the key
+        keep = scan if self.string_start is None else self.string_start
+        self.buf = buf[keep:]
+        self.scan = scan - keep
+        if self.string_start is not None:
+            self.string_start -= keep
+        return None
+
 
-user = os.environ["USER"]
-baseurl = NLA_SERVER_URL
+def _iter_json_array(chunks, key):
+    """Incrementally decode the items of the list `key` in a JSON object, e.g. the "files" list in
+       {"count": 2, "files": [{...}, {...}]}, from an iterable of text chunks.  Only the item currently being
+       decoded is held in memory, rather than the whole document.  The items can be any JSON values.  Only the
+       list in the top level object is decoded, not one of the same name in a nested object."""
+    decoder = json.JSONDecoder()
+    start = _ListStart(key)
+    buf = ""
+    pos = None      # position in buf just inside the list, once the start of the list has been found
+    chunks = iter(chunks)
+    exhausted = False
+    while True:
+        if pos is None:
+            rest = start.feed(buf)
+            if rest is None:
+                buf = ""
+            else:
+                buf = rest
+                pos = 0
+        if pos is not None:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos < len(buf):
+                if buf[pos] == "]":
+                    return
+                if buf[pos] == ",":
+                    pos = _WHITESPACE.match(buf, pos + 1).end()
+                if pos < len(buf):
+                    try:
+                        item, end = decoder.raw_decode(buf, pos)
+                    except ValueError:
+                        # item not complete yet - fall through and read more
+                        if exhausted:
+                            raise
+                    else:
+                        # only take the item once the "," or "]" after it has been read, as a number split
+                        # across chunks (e.g. "1.5" then "e3") also decodes from its first part
+                        after = _WHITESPACE.match(buf, end).end()
+                        if exhausted or (after < len(buf) and buf[after] in ",]"):
+                            yield item
+                            pos = end
+                            continue
+            # discard everything already decoded
+            buf = buf[pos:]
+            pos = 0
+        if exhausted:
+            if pos is None:
+                return
+            raise ValueError("Unexpected end of JSON document while reading \"%s\"" % key)
+        try:
+            buf += next(chunks)
+        except StopIteration:
+            exhausted = True
+
+
+class NLAClient(object):
+    """A client for the NLA REST-style API which keeps a single pooled `requests.Session` open, so that
+       consecutive calls reuse the same TCP / TLS connection rather than performing a new handshake each time.
+
+       Idempotent requests (GET, PUT) which fail with a connection error or a 5xx status code are retried, with
+       an exponential backoff and random jitter between the attempts.  POST requests are never retried, as that
+       could create a duplicate retrieval request.
+
+       :param string server_url: (`optional`) base url of the NLA server, default from `nla_client_settings`
+       :param string quota_user: (`optional`) user id of the quota to use, default is the current user, looked up
+                                 when a call first needs it
+       :param verify: (`optional`) verify the server's TLS certificate (`bool`) or a path to a CA bundle
+       :param integer pool_size: (`optional`) maximum number of connections to keep open to the server
+       :param timeout: (`optional`) timeout in seconds, either a single number or a (connect, read) tuple
+       :param integer max_retries: (`optional`) number of times to retry a failed idempotent request
+       :param float backoff_factor: (`optional`) base of the backoff, in seconds, between retries
+       :param float request_list_ttl: (`optional`) number of seconds the result of :meth:`list_requests` is reused
+                                      for.  The cached list is dropped whenever a request is made or updated.
+
+       :param http_cache: (`optional`) the :class:`nla_client_cache.ResponseCache` for the responses of
+                          :meth:`list_requests` and :meth:`show_request`, or False to not cache them.  The default
+                          keeps them in memory, and in the file named by the http_cache_file setting if it is set.
+
+       Every call to the server can be timed by registering a hook with :meth:`add_hook`.  When no hooks are
+       registered nothing is timed.
+
+       The responses of :meth:`list_requests` and :meth:`show_request` are kept, and the server is asked to send
+       them again only if they have changed (with If-None-Match / If-Modified-Since).  Responses are also
+       requested gzip compressed (Accept-Encoding: gzip, as `requests` does by default).
+    """
+
+    def __init__(self, server_url=None, quota_user=None, verify=None, pool_size=None, timeout=None,
+                 max_retries=None, backoff_factor=None, request_list_ttl=None, http_cache=None):
+        self.server_url = server_url or baseurl or nla_client_settings.server_url()
+        self._user = quota_user or user
+        self.verify = verify if verify is not None else nla_client_settings.verify_cert()
+        self.pool_size = pool_size if pool_size is not None else POOL_SIZE
+        self.timeout = timeout if timeout is not None else TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else MAX_RETRIES
+        self.backoff_factor = backoff_factor if backoff_factor is not None else BACKOFF_FACTOR
+        self.request_list_ttl = request_list_ttl if request_list_ttl is not None else REQUEST_LIST_TTL
+        self._session = None
+        self._request_list = None       # (time fetched, result of list_requests)
+        if http_cache is None:
+            from nla_client.nla_client_cache import ResponseCache
+            http_cache = ResponseCache(filename=nla_client_settings.http_cache_file())
+        self.http_cache = http_cache if http_cache is not False else None
+        self.hooks = []
+
+    @property
+    def user(self):
+        """The user id of the quota to use, taken from the settings when it is first needed, so that calls which do
+           not use a quota (e.g. :meth:`ls`) work without one."""
+        if self._user is None:
+            self._user = nla_client_settings.quota_user()
+        return self._user
+
+    @user.setter
+    def user(self, value):
+        self._user = value
+
+    @property
+    def session(self):
+        """The pooled `requests.Session`, created on first use."""
+        if self._session is None:
+            import requests
+            session = requests.Session()
+            # retries are handled in _request so that they can be restricted to idempotent methods and jittered
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                                    max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.verify = self.verify
+            self._session = session
+        return self._session
+
+    def close(self):
+        """Close all the pooled connections to the server, and save the cached responses if they are kept in a
+           file."""
+        if self.http_cache is not None:
+            self.http_cache.save()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_hook(self, hook):
+        """Register a function to be called with a record of each call made to the server.  The record is a
+           dictionary with the keys:
+
+           - **method** (`string`), **endpoint** (`string`): e.g. "GET" and "/api/v1/requests/{id}"
+           - **status** (`integer`): the HTTP status code, or None if the call failed with a connection error
+           - **error** (`string`): the connection error, if there was one
+           - **attempts** (`integer`): number of times the call was sent, i.e. 1 + the number of retries
+           - **new_connection** (`bool`): whether a new connection had to be made to the server for the call
+           - **wait** (`float`): seconds from sending the call to receiving the response headers.  This includes
+             making the connection, if a new one was needed, and the time taken by the server.
+           - **transfer** (`float`): seconds taken to receive the body of the response.  For a streamed file
+             listing this also includes decoding it, but not the time spent by the caller on each file.
+           - **decode** (`float`): seconds taken to decode the JSON body, if it was decoded separately
+           - **total** (`float`): seconds for the whole call, including retries
+           - **bytes** (`integer`): size of the response body received
+           - **records** (`integer`): number of files or requests in the response, where it is a list of them
+
+           :param hook: function taking the record as its only argument"""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Unregister a function registered with :meth:`add_hook`."""
+        self.hooks.remove(hook)
+
+    def _timing(self, method, path):
+        """Start a record of a call, for the hooks."""
+        endpoint = re.sub(r"/requests/\d+$", "/requests/{id}", path)
+        endpoint = re.sub(r"/quota/[^/]+$", "/quota/{user}", endpoint)
+        return {"method": method, "endpoint": endpoint, "status": None, "error": None, "attempts": 0,
+                "new_connection": None, "wait": None, "transfer": None, "decode": None, "total": None,
+                "bytes": None, "records": None, "start": time.perf_counter()}
+
+    def _emit(self, timing, response=None):
+        """Complete the record of a call and pass it to the hooks."""
+        timing["total"] = time.perf_counter() - timing.pop("start")
+        if response is not None and timing["bytes"] is None:
+            tell = getattr(response.raw, "tell", None)
+            timing["bytes"] = tell() if tell is not None else len(response.content)
+        for hook in self.hooks:
+            hook(timing)
+
+    def _connections(self, url):
+        """Number of connections made so far to the server, to tell whether a call needed a new one."""
+        try:
+            pools = self.session.get_adapter(url).poolmanager.pools
+            return sum(pools[key].num_connections for key in pools.keys())
+        except (AttributeError, KeyError):
+            return None
+
+    def backoff(self, attempt):
+        """Time to sleep before retry number `attempt` (starting at 0): exponential, with "full jitter" so that
+           many clients failing at once do not all retry at the same moment."""
+        return random.uniform(0, self.backoff_factor * (2 ** attempt))
+
+    def _request(self, method, path, timing=None, **kwargs):
+        """Send a request to the server, retrying idempotent requests on connection errors and 5xx responses.
+           Returns the final `requests.Response`, or raises the final connection error.
+
+           If hooks are registered the call is timed.  If the caller passes a `timing` record (from :meth:`_timing`)
+           it completes it, e.g. with the decode time, and passes it to :meth:`_emit`; otherwise the record is
+           passed to the hooks here."""
+        import requests
+        url = self.server_url + path
+        kwargs.setdefault("timeout", self.timeout)
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        session = self.session
+        emit = timing is None and bool(self.hooks)
+        if emit:
+            timing = self._timing(method, path)
+        elif timing is not None:
+            timing["start"] = time.perf_counter()   # not counting the set up of the session
+        attempt = 0
+        while True:
+            if timing is not None:
+                timing["attempts"] = attempt + 1
+                connections = self._connections(url)
+                sent = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= retries:
+                    if timing is not None:
+                        timing["error"] = str(e)
+                        self._emit(timing)
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    if timing is not None:
+                        timing["status"] = response.status_code
+                        if connections is not None:
+                            timing["new_connection"] = self._connections(url) > connections
+                        timing["wait"] = response.elapsed.total_seconds()
+                        if not kwargs.get("stream"):
+                            # the body has already been read
+                            timing["transfer"] = max(time.perf_counter() - sent - timing["wait"], 0)
+                        if emit:
+                            self._emit(timing, response)
+                    return response
+                response.close()
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def _get_json(self, path, records_key=None, any_status=False, cache=False, **kwargs):
+        """GET `path` and decode the JSON response, if the status is 200 OK or `any_status`.  Returns the response
+           and the decoded JSON, or None.
+
+           If `cache` is True the decoded JSON is kept in the :attr:`http_cache`, and next time the server is asked
+           to send it only if it has changed.  If it has not (304 Not Modified) the kept JSON is returned."""
+        url = self.server_url + path
+        cached = None
+        if cache and self.http_cache is not None:
+            cached = self.http_cache.get(url)
+            if cached is not None:
+                etag, last_modified, _ = cached
+                headers = dict(kwargs.pop("headers", None) or {})
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+                kwargs["headers"] = headers
+        timing = self._timing("GET", path) if self.hooks else None
+        response = self._request("GET", path, timing=timing, **kwargs)
+        data = None
+        if response.status_code == 304 and cached is not None:
+            data = cached[2]
+        elif any_status or response.status_code == 200:
+            start = time.perf_counter()
+            data = response.json()
+            if timing is not None:
+                timing["decode"] = time.perf_counter() - start
+            if cache and self.http_cache is not None and response.status_code == 200:
+                self.http_cache.put(url, response, data)
+        if timing is not None and data is not None:
+            if records_key is not None and isinstance(data, dict) and records_key in data:
+                timing["records"] = len(data[records_key])
+        if timing is not None:
+            self._emit(timing, response)
+        return response, data
+
+    def ls(self, match, stages):
+        """See :func:`ls`."""
+        response, files = self._get_json("/api/v1/files", records_key="files", any_status=True,
+                                         params={"match": match, "stages": stages})
+        return files
+
+    def iter_files(self, match, stages, page_size=None):
+        """See :func:`iter_files`."""
+        params = {"match": match, "stages": stages}
+        offset = 0
+        first_path = None
+        while True:
+            if page_size:
+                params["offset"] = offset
+                params["limit"] = page_size
+            timing = self._timing("GET", "/api/v1/files") if self.hooks else None
+            response = self._request("GET", "/api/v1/files", timing=timing, params=params, stream=True)
+            body_start = time.perf_counter()
+            suspended = 0.0     # time spent by the caller between files, not counted as transfer time
+            n = 0
+            try:
+                response.raise_for_status()
+                if timing is not None:
+                    timing["bytes"] = 0
+                chunks = _decode_chunks(response.iter_content(STREAM_CHUNK_SIZE), response.encoding or "utf-8",
+                                        timing)
+                for f in _iter_json_array(chunks, "files"):
+                    if n == 0:
+                        # a server that ignores offset returns the same first file again
+                        if offset and f.get("path") == first_path:
+                            return
+                        first_path = f.get("path")
+                    n += 1
+                    if timing is None:
+                        yield f
+                    else:
+                        yielded = time.perf_counter()
+                        yield f
+                        suspended += time.perf_counter() - yielded
+            finally:
+                if timing is not None:
+                    timing["transfer"] = time.perf_counter() - body_start - suspended
+                    timing["records"] = n
+                    timing["start"] += suspended
+                    self._emit(timing, response)
+                response.close()
+            # a short page is the last one.  A page longer than requested means the server does not support
+            # paging and has already returned everything.
+            if not page_size or n != page_size:
+                return
+            offset += n
+
+    def lookup_files(self, paths, stages="UDTAR", max_calls=None, workers=None):
+        """See :func:`lookup_files`."""
+        from concurrent.futures import ThreadPoolExecutor
+        by_dir = {}
+        for path in paths:
+            by_dir.setdefault(os.path.dirname(path) + "/", set()).add(path)
+        directories = sorted(by_dir)
+        max_calls = max_calls or LOOKUP_MAX_CALLS
+        # with many directories (e.g. one per day), directories are merged under their ancestors, going up one level
+        # at a time until there are at most max_calls of them, but never above LOOKUP_MIN_DEPTH path components:
+        # listing everything under e.g. /badc costs far more than a few more calls.  Each group is listed with the
+        # longest prefix common to its directories, which also covers their subdirectories.
+        groups = dict((directory, [directory]) for directory in directories)
+        depth = max(d.count("/") for d in directories) if directories else 0
+        # the groups at depth have depth - 1 components, as the path starts with "/"
+        while len(groups) > max_calls and depth - 1 > LOOKUP_MIN_DEPTH:
+            depth -= 1
+            groups = {}
+            for directory in directories:
+                groups.setdefault("/".join(directory.split("/")[:depth]), []).append(directory)
+        wanted = {}
+        for members in groups.values():
+            prefix = os.path.commonprefix(members)
+            wanted.setdefault(prefix, set()).update(*(by_dir[d] for d in members))
+
+        def lookup(item):
+            prefix, group_paths = item
+            return [f for f in self.iter_files(prefix, stages) if f["path"] in group_paths]
+
+        found = {}
+        with ThreadPoolExecutor(max_workers=workers or BULK_WORKERS) as executor:
+            for files in executor.map(lookup, wanted.items()):
+                for f in files:
+                    found[f["path"]] = f
+        return found
+
+    def make_request(self, patterns=None, retention=None, files=None, label=None):
+        """See :func:`make_request`."""
+        data = {"quota": self.user}
+        assert patterns is None or files is None, "Can't define request files from list and pattern."
+        if patterns:
+            data["patterns"] = patterns
+        if files:
+            data["files"] = files
+        if retention:
+            data["retention"] = retention
+        if label:
+            data["label"] = label
+        response = self._request("POST", "/api/v1/requests", data=json.dumps(data))
+        if response.status_code == 200:
+            self.invalidate_request_list()
+        return response
+
+    def update_request(self, request_id, retention=None, label=None, notify_first=None, notify_last=None):
+        """See :func:`update_request`."""
+        data = {"quota": self.user}
+        if retention:
+            data["retention"] = retention
+        if label:
+            data["label"] = label
+        if notify_first is not None:    # allow null string so that the default email in the user's quota can be used
+            data["notify_on_first_file"] = notify_first
+        if notify_last is not None:
+            data["notify_on_last_file"] = notify_last
+        response = self._request("PUT", "/api/v1/requests/%s" % request_id, data=json.dumps(data))
+        if response.status_code == 200:
+            self.invalidate_request_list()
+        return response
+
+    def list_requests(self, max_age=None):
+        """See :func:`list_requests`."""
+        if max_age is None:
+            max_age = self.request_list_ttl
+        if self._request_list is not None and time.time() - self._request_list[0] < max_age:
+            return self._request_list[1]
+        fetched = time.time()
+        response, quota = self._get_json("/api/v1/quota/%s" % self.user, records_key="requests", cache=True)
+        if quota is not None:
+            self._request_list = (fetched, quota)
+        return quota
+
+    def invalidate_request_list(self):
+        """Drop the cached result of :meth:`list_requests`, so that the next call fetches it from the server."""
+        self._request_list = None
+
+    def show_request(self, request_number):
+        """See :func:`show_request`."""
+        response, request_info = self._get_json("/api/v1/requests/%s" % request_number, records_key="files",
+                                                cache=True)
+        return request_info
+
+
+_default_client = None
+
+def get_client():
+    """Return the default :class:`NLAClient`, shared by the module level functions, creating it if needed.
+
+       :rtype: NLAClient"""
+    global _default_client
+    if _default_client is None:
+        _default_client = NLAClient()
+    return _default_client
+
+def set_client(client):
+    """Replace the default :class:`NLAClient` used by the module level functions, e.g. to use a different
+       server, pool size or retry policy.
+
+       :param NLAClient client: the client to use"""
+    global _default_client
+    if _default_client is not None and _default_client is not client:
+        _default_client.close()
+    _default_client = client
 
 def ls(match, stages):
     """.. |br| raw:: html
@@ -46,9 +607,42 @@ def ls(match, stages):
 
        :rtype: Dictionary
        """
-    url = baseurl + "/api/v1/files?match=%s&stages=%s" % (match, stages)
-    response = requests.get(url, verify=VERIFY_CERT)
-    return response.json()
+    return get_client().ls(match, stages)
+
+def iter_files(match, stages, page_size=None):
+    """Iterate over the files in the NLA system given a pattern to match against, and a combination of stages
+       of the files to filter on.  Unlike :func:`ls`, the response is decoded incrementally as it arrives, so the
+       first file is available straight away and memory use does not grow with the number of files.
+
+       :param string match: A pattern to match filenames against - i.e. does a filename contain this substring
+       :param string stages: Filter the files based on the stage of the file within the NLA system.  Stages can be any combination of **UDTAR**
+       :param integer page_size: (`optional`) fetch the files from the server in pages of this many files, using
+                                 the `offset` and `limit` query parameters.  If the server does not support paging
+                                 all of the files are streamed from the first response.
+
+       :return: An iterator over the information about each file, as the "files" Dictionaries returned by :func:`ls`
+       :rtype: Iterator[Dictionary]
+       """
+    return get_client().iter_files(match, stages, page_size=page_size)
+
+def lookup_files(paths, stages="UDTAR", max_calls=None, workers=None):
+    """Look up the information for a set of files in the NLA system, in a few calls rather than one call per file.
+       Files are listed by directory, and when there are more than `max_calls` directories, neighbouring
+       directories are listed together with the path they have in common.  Directories are only merged as far up as
+       LOOKUP_MIN_DEPTH path components, so more than `max_calls` calls are made for files spread over many
+       datasets.  The calls are made concurrently.
+
+       :param Iterable[string] paths: the logical paths of the files to look up
+       :param string stages: (`optional`) only return files at these stages, any combination of **UDTAR**
+       :param integer max_calls: (`optional`) number of calls to aim for, default LOOKUP_MAX_CALLS
+       :param integer workers: (`optional`) number of calls to make at once, default BULK_WORKERS
+
+       :return: A dictionary mapping each path which was found to the information about the file, as the "files"
+                Dictionaries returned by :func:`ls`.  Paths which are not in the NLA system, or not at one of
+                `stages`, are not included.
+       :rtype: Dictionary
+       """
+    return get_client().lookup_files(paths, stages, max_calls, workers)
 
 def make_request(patterns=None, retention=None, files=None, label=None):
     """Add a retrieval request into the NLA system
@@ -72,20 +666,7 @@ def make_request(patterns=None, retention=None, files=None, label=None):
 
        :rtype: `requests.Response <http://docs.python-requests.org/en/master/api/#requests.Response>`_
        """
-
-    url = baseurl + "/api/v1/requests"
-    data = {"quota": user}
-    assert patterns is None or files is None, "Can't define request files from list and pattern."
-    if patterns:
-        data["patterns"] = patterns
-    if files:
-        data["files"] = files
-    if retention:
-        data["retention"] = retention
-    if label:
-        data["label"] = label
-    response = requests.post(url, data=json.dumps(data), verify=VERIFY_CERT)
-    return response
+    return get_client().make_request(patterns=patterns, retention=retention, files=files, label=label)
 
 def update_request(request_id, retention=None, label=None, notify_first=None, notify_last=None):
     """Update an existing retrieval request in the NLA system
@@ -112,22 +693,18 @@ def update_request(request_id, retention=None, label=None, notify_first=None, no
        :rtype: `requests.Response <http://docs.python-requests.org/en/master/api/#requests.Response>`_
 
     """
-    url = baseurl + "/api/v1/requests/%s" % request_id
-    data = {"quota": user}
-    if retention:
-        data["retention"] = retention
-    if label:
-        data["label"] = label
-    if notify_first is not None:    # allow null string so that the default email in the user's quota can be used
-        data["notify_on_first_file"] = notify_first
-    if notify_last is not None:
-        data["notify_on_last_file"] = notify_last
-    response = requests.put(url, data=json.dumps(data), verify=VERIFY_CERT)
-    return response
-
-def list_requests():
+    return get_client().update_request(request_id, retention=retention, label=label, notify_first=notify_first,
+                                       notify_last=notify_last)
+
+def list_requests(max_age=None):
     """List all retrieval requests which have not passed their retention date for the current user.
 
+       The result is cached by the client for a short time (`REQUEST_LIST_TTL` seconds in `nla_client_settings`),
+       and the cache is cleared whenever a request is made or updated through the same client.
+
+       :param float max_age: (`optional`) maximum age, in seconds, of a cached result to return.  Use 0 to always
+                             fetch from the server.
+
        :return: A dictionary containing details about the user and the user's requests, consisting of the following keys:
 
                 - **used** (`integer`): the amount of quota the user has used, in bytes
@@ -152,12 +729,7 @@ def list_requests():
                 - **last_files_on_disk** (`DateTime`): the date and time the last files arrived on the restore disk
 
        :returntype: Dictionary"""
-    url = baseurl + "/api/v1/quota/%s" % user
-    response = requests.get(url, verify=VERIFY_CERT)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    return get_client().list_requests(max_age=max_age)
 
 def show_request(request_number):
     """Show the information for a single request, given the integer identifier of the request.
@@ -181,9 +753,4 @@ def show_request(request_number):
                 - **files** (`List[string]`): list of files in the request
 
     """
-    url = baseurl + "/api/v1/requests/%s" % request_number
-    response = requests.get(url, verify=VERIFY_CERT)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    return get_client().show_request(request_number)
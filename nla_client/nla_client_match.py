@@ -0,0 +1,252 @@
+"""nla_client_match.py finds the files which match any of a (possibly long) list of patterns with a single listing
+   from the NLA server, rather than one `ls` for each pattern.  The listing is fetched using the longest substring
+   common to all the patterns, and each path is matched against all the patterns at once with an Aho-Corasick
+   automaton built from the fixed text in each pattern.
+
+   A pattern file has one pattern per line.  Blank lines and lines starting with # are skipped, and each pattern is
+   one of:
+
+   - a substring of the path, e.g. ``2015/12/04``
+   - a glob matched against the whole path, if it contains any of ``*?[``, e.g. ``*/station_0[1-5]/*.nc``
+   - a regular expression searched for in the path, if it starts with ``re:``, e.g. ``re:_(01|02)\\.nc$``
+"""
+
+import re
+import fnmatch
+from collections import deque
+
+from nla_client import nla_client_lib
+
+#: the kinds of pattern
+SUBSTRING = "substring"
+GLOB = "glob"
+REGEX = "regex"
+
+_REGEX_SPECIAL = ".^$*+?{}[]\\|()"
+
+# an inline flag, e.g. (?i) or (?i:...), which can change what the fixed text of a regex matches
+_INLINE_FLAGS = re.compile(r"\(\?[aiLmsux-]*[aiLmsux][aiLmsux-]*[:)]")
+
+
+def _regex_literal(regex):
+    """The longest run of fixed text that any match of `regex` must contain, or "" if none can be found.  This
+       is conservative: it only looks outside groups, and gives up on alternatives outside groups."""
+    runs = []
+    run = ""
+    depth = 0
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        if c == "\\":
+            if i + 1 < len(regex) and regex[i + 1] in _REGEX_SPECIAL + "/-":
+                if depth == 0:
+                    run += regex[i + 1]
+            else:
+                runs.append(run)
+                run = ""
+            i += 2
+            continue
+        if c in "*?{":
+            # the character before is optional
+            run = run[:-1]
+        if c in _REGEX_SPECIAL:
+            runs.append(run)
+            run = ""
+            if c == "|" and depth == 0:
+                return ""
+            if c == "(":
+                depth += 1
+            elif c == ")":
+                depth -= 1
+            elif c == "[":
+                i = regex.find("]", i + 2)
+                if i < 0:
+                    break
+            elif c == "{":
+                i = regex.find("}", i)
+                if i < 0:
+                    break
+        elif depth == 0:
+            run += c
+        i += 1
+    runs.append(run)
+    return max(runs, key=len)
+
+def _glob_literal(glob):
+    """The longest run of fixed text in a glob."""
+    return max(re.split(r"\*|\?|\[[^]]*\]", glob), key=len)
+
+
+class Pattern(object):
+    """One pattern to match against file paths.
+
+       :param string text: the pattern, as written in a pattern file
+    """
+
+    def __init__(self, text):
+        self.text = text
+        if text.startswith("re:"):
+            self.kind = REGEX
+            self.regex = re.compile(text[3:])
+            if self.regex.flags & re.IGNORECASE or _INLINE_FLAGS.search(text[3:]):
+                # the fixed text may not appear as written in a match, so every path has to be tried
+                self.literal = ""
+            else:
+                self.literal = _regex_literal(text[3:])
+        elif any(c in text for c in "*?["):
+            self.kind = GLOB
+            self.regex = re.compile(fnmatch.translate(text))
+            self.literal = _glob_literal(text)
+        else:
+            self.kind = SUBSTRING
+            self.regex = None
+            self.literal = text
+
+    def __repr__(self):
+        return "Pattern(%r)" % self.text
+
+    def matches(self, path):
+        """Whether the path matches the pattern."""
+        if self.kind == SUBSTRING:
+            return self.literal in path
+        if self.kind == GLOB:
+            return self.regex.match(path) is not None
+        return self.regex.search(path) is not None
+
+
+class Automaton(object):
+    """An Aho-Corasick automaton, which finds every occurrence of any of a set of words in a string in one pass
+       over the string, however many words there are."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, word, value):
+        """Add a word, with the value to report when it is found."""
+        node = 0
+        for c in word:
+            next_node = self.goto[node].get(c)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][c] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append(value)
+
+    def build(self):
+        """Make the failure links, after all the words are added."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(c, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """Return the set of values of the words found in `text`."""
+        found = set()
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        node = 0
+        for c in text:
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class MultiMatcher(object):
+    """Match file paths against many patterns at once.
+
+       :param List patterns: the patterns, as strings or `Pattern` objects
+    """
+
+    def __init__(self, patterns):
+        self.patterns = [p if isinstance(p, Pattern) else Pattern(p) for p in patterns]
+        self.automaton = Automaton()
+        # patterns with no fixed text have to be tried against every path
+        self.unanchored = []
+        for n, pattern in enumerate(self.patterns):
+            if pattern.literal:
+                self.automaton.add(pattern.literal, n)
+            else:
+                self.unanchored.append(n)
+        self.automaton.build()
+
+    def match(self, path):
+        """Return the positions in `patterns` of the patterns that match the path, in order.
+
+           :rtype: List[integer]"""
+        candidates = self.automaton.find(path)
+        candidates.update(self.unanchored)
+        patterns = self.patterns
+        return sorted(n for n in candidates if patterns[n].kind == SUBSTRING or patterns[n].matches(path))
+
+    def server_filter(self):
+        """The longest substring common to the fixed text of all the patterns, to give to the NLA server to
+           narrow down the listing.  This is "" if the patterns have nothing in common.
+
+           :rtype: string"""
+        if self.unanchored or not self.patterns:
+            return ""
+        literals = sorted(set(p.literal for p in self.patterns), key=len)
+        shortest = literals[0]
+        for length in range(len(shortest), 0, -1):
+            candidates = set(shortest[i:i + length] for i in range(len(shortest) - length + 1))
+            for literal in literals[1:]:
+                candidates = set(c for c in candidates if c in literal)
+                if not candidates:
+                    break
+            if candidates:
+                return max(candidates)
+        return ""
+
+
+def read_patterns(lines):
+    """Read the patterns from a pattern file, skipping blank lines and lines starting with #.
+
+       :param lines: an iterable of lines, e.g. a file object
+       :rtype: List[Pattern]"""
+    patterns = []
+    for line in lines:
+        text = line.strip()
+        if text and not text.startswith("#"):
+            patterns.append(Pattern(text))
+    return patterns
+
+def match_files(patterns, stages="UDTAR", files=None, client=None):
+    """Find the files which match each of the patterns, with a single listing from the NLA server.
+
+       :param List patterns: the patterns, as strings or `Pattern` objects, or a `MultiMatcher`
+       :param string stages: (`optional`) only list files at these stages, any combination of **UDTAR**
+       :param files: (`optional`) an iterable of file Dictionaries to match instead of a listing from the server,
+                     e.g. from a local index.  It should contain all the files which contain `server_filter()`.
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+       :return: A list of the matching paths for each pattern, in the order of `patterns`, and the list of all the
+                paths matching any pattern, in the order they were listed
+       :rtype: Tuple[List[List[string]], List[string]]"""
+    matcher = patterns if isinstance(patterns, MultiMatcher) else MultiMatcher(patterns)
+    if files is None:
+        client = client or nla_client_lib.get_client()
+        files = client.iter_files(matcher.server_filter(), stages)
+    by_pattern = [[] for _ in matcher.patterns]
+    matched = []
+    for f in files:
+        path = f["path"]
+        hits = matcher.match(path)
+        if hits:
+            matched.append(path)
+            for n in hits:
+                by_pattern[n].append(path)
+    return by_pattern, matched
@@ -0,0 +1,100 @@
+"""nla_client_metrics.py collects the timings of the calls made to the NLA server by an `NLAClient`, and reports
+   them as a summary, as JSON, or as a Prometheus textfile (for the node_exporter textfile collector)."""
+
+import os
+import json
+
+#: the parts of a call that are timed, as in the records passed to the hooks of an `NLAClient`
+PHASES = ("wait", "transfer", "decode")
+
+
+class CallTimings(object):
+    """A hook for :meth:`nla_client_lib.NLAClient.add_hook` which keeps the record of every call::
+
+           timings = CallTimings()
+           nla_client_lib.get_client().add_hook(timings)
+           ...
+           print(timings.summary())
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def by_endpoint(self):
+        """Totals for each method and endpoint.
+
+           :return: A dictionary mapping (method, endpoint) to a dictionary of the number of calls, number of
+                    errors, retries, new connections, bytes, records, and the total seconds of each phase and overall
+           :rtype: Dictionary"""
+        totals = {}
+        for r in self.records:
+            t = totals.setdefault((r["method"], r["endpoint"]), dict(
+                calls=0, errors=0, retries=0, new_connections=0, bytes=0, records=0, total=0.0,
+                statuses={}, **dict((phase, 0.0) for phase in PHASES)))
+            t["calls"] += 1
+            t["retries"] += max(r["attempts"] - 1, 0)
+            t["total"] += r["total"] or 0.0
+            t["bytes"] += r["bytes"] or 0
+            t["records"] += r["records"] or 0
+            if r["new_connection"]:
+                t["new_connections"] += 1
+            if r["error"] is not None or (r["status"] or 0) >= 400:
+                t["errors"] += 1
+            status = str(r["status"]) if r["status"] is not None else "error"
+            t["statuses"][status] = t["statuses"].get(status, 0) + 1
+            for phase in PHASES:
+                t[phase] += r[phase] or 0.0
+        return totals
+
+    def summary(self):
+        """A table of the totals for each endpoint, as a string."""
+        lines = ["%-6s %-26s %5s %5s %5s %9s %9s %9s %9s %12s %9s" % (
+            "", "endpoint", "calls", "errs", "retry", "wait s", "xfer s", "decode s", "total s", "bytes", "records")]
+        for (method, endpoint), t in sorted(self.by_endpoint().items()):
+            lines.append("%-6s %-26s %5i %5i %5i %9.3f %9.3f %9.3f %9.3f %12i %9i" % (
+                method, endpoint, t["calls"], t["errors"], t["retries"], t["wait"], t["transfer"], t["decode"],
+                t["total"], t["bytes"], t["records"]))
+        return "\n".join(lines)
+
+    def write_json(self, filename):
+        """Write the record of every call, and the totals for each endpoint, to a JSON file."""
+        totals = [dict(method=method, endpoint=endpoint, **t) for (method, endpoint), t in
+                  sorted(self.by_endpoint().items())]
+        with open(filename, "w") as fh:
+            json.dump({"calls": self.records, "endpoints": totals}, fh, indent=1)
+
+    def write_prometheus(self, filename):
+        """Write the totals for each endpoint in the Prometheus text format, e.g. for the node_exporter textfile
+           collector.  The file is written under a temporary name and renamed, so it is never read half written."""
+        metrics = [
+            ("nla_client_calls_total", "counter", "Calls made to the NLA server"),
+            ("nla_client_retries_total", "counter", "Calls to the NLA server that were retried"),
+            ("nla_client_new_connections_total", "counter", "New connections made to the NLA server"),
+            ("nla_client_response_bytes_total", "counter", "Bytes received from the NLA server"),
+            ("nla_client_response_records_total", "counter", "Files or requests received from the NLA server"),
+            ("nla_client_call_seconds_total", "counter", "Seconds spent in calls to the NLA server, by phase"),
+        ]
+        keys = {"nla_client_retries_total": "retries", "nla_client_new_connections_total": "new_connections",
+                "nla_client_response_bytes_total": "bytes", "nla_client_response_records_total": "records"}
+        totals = sorted(self.by_endpoint().items())
+        lines = []
+        for name, kind, text in metrics:
+            lines.append("# HELP %s %s" % (name, text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for (method, endpoint), t in totals:
+                labels = 'method="%s",endpoint="%s"' % (method, endpoint)
+                if name == "nla_client_calls_total":
+                    for status, count in sorted(t["statuses"].items()):
+                        lines.append('%s{%s,status="%s"} %i' % (name, labels, status, count))
+                elif name == "nla_client_call_seconds_total":
+                    for phase in PHASES + ("total",):
+                        lines.append('%s{%s,phase="%s"} %f' % (name, labels, phase, t[phase]))
+                else:
+                    lines.append("%s{%s} %i" % (name, labels, t[keys[name]]))
+        tmp = filename + ".tmp"
+        with open(tmp, "w") as fh:
+            fh.write("\n".join(lines) + "\n")
+        os.rename(tmp, filename)
@@ -0,0 +1,162 @@
+"""nla_client_plan.py provides functions to prepare retrieval requests before they are submitted to the NLA
+   system, such as removing files which are already on disk or already requested, or splitting a set of files too
+   large for the user's quota into batches to request one after another."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from nla_client import nla_client_lib
+from nla_client.nla_client_settings import BULK_WORKERS
+
+#: stages at which a file is already on disk and does not need restoring
+ON_DISK_STAGES = "UDR"
+
+#: stages at which a file is being restored
+RESTORING_STAGES = "A"
+
+
+def requested_files(client=None, workers=None):
+    """Return the set of files in the current user's active requests.
+
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+       :param integer workers: (`optional`) number of requests to fetch at once
+       :rtype: Set[string]"""
+    client = client or nla_client_lib.get_client()
+    quota = client.list_requests()
+    if quota is None:
+        return set()
+    files = set()
+    with ThreadPoolExecutor(max_workers=workers or BULK_WORKERS) as executor:
+        for request_info in executor.map(client.show_request, [req["id"] for req in quota["requests"]]):
+            if request_info is not None:
+                files.update(request_info.get("files", []))
+    return files
+
+def prune_request(files=None, patterns=None, client=None):
+    """Work out which of the files for a new retrieval request actually need to be restored.  Files which are
+       already on disk (stages **U**, **D** and **R**), being restored (stage **A**), or in one of the user's
+       active requests, are removed, as are paths which are not in the NLA system.  The total size of the files
+       that are left is checked against the user's remaining quota.
+
+       :param List[string] files: (`optional`) list of files to request to restore
+       :param string patterns: (`optional`) pattern to match in a logical file path, as for `make_request`
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+
+       :return: A dictionary with the keys:
+
+                - **files** (`List[string]`): the files which need restoring, to use in `make_request`
+                - **size** (`integer`): the total size of these files in bytes
+                - **sizes** (`Dictionary`): the size in bytes of each of these files
+                - **pruned** (`Dictionary`): the files which were removed, under the keys **on_disk**,
+                  **restoring**, **requested** and **unknown** (not in the NLA system)
+                - **quota_remaining** (`integer`): the user's remaining quota in bytes, or None if not known
+                - **over_quota** (`bool`): True if the files will not fit in the remaining quota
+
+       :rtype: Dictionary
+    """
+    client = client or nla_client_lib.get_client()
+    assert patterns is None or files is None, "Can't define request files from list and pattern."
+    if patterns:
+        found = {}
+        for f in client.iter_files(patterns, "UDTAR"):
+            found[f["path"]] = f
+        paths = list(found)
+    else:
+        paths = list(dict.fromkeys(files or []))     # remove duplicates, keeping the order
+        found = client.lookup_files(paths)
+
+    pruned = {"on_disk": [], "restoring": [], "requested": [], "unknown": []}
+    candidates = []
+    for path in paths:
+        f = found.get(path)
+        if f is None:
+            pruned["unknown"].append(path)
+        elif f["stage"] in ON_DISK_STAGES:
+            pruned["on_disk"].append(path)
+        elif f["stage"] in RESTORING_STAGES:
+            pruned["restoring"].append(path)
+        else:
+            candidates.append(path)
+
+    keep = []
+    sizes = {}
+    if candidates:
+        in_requests = requested_files(client)
+        for path in candidates:
+            if path in in_requests:
+                pruned["requested"].append(path)
+            else:
+                keep.append(path)
+                sizes[path] = int(found[path].get("size") or 0)
+    size = sum(sizes.values())
+
+    quota = client.list_requests()
+    remaining = int(quota["size"]) - int(quota["used"]) if quota is not None else None
+    return {"files": keep,
+            "size": size,
+            "sizes": sizes,
+            "pruned": pruned,
+            "quota_remaining": remaining,
+            "over_quota": remaining is not None and size > remaining}
+
+def plan_batches(files=None, patterns=None, max_size=None, min_fill=0.9, client=None):
+    """Split the files which need restoring (as found by `prune_request`) into batches which each fit in the
+       user's quota, to be requested one after another as the earlier requests expire.
+
+       To keep the number of tapes read for each batch small, the files are taken in order of directory, so
+       each batch holds whole directories next to each other in the archive.  A directory is only split between
+       two batches when it is larger than a whole batch, or to fill a batch that would otherwise be less than
+       `min_fill` full.
+
+       :param List[string] files: (`optional`) list of files to restore
+       :param string patterns: (`optional`) pattern to match in a logical file path, as for `make_request`
+       :param integer max_size: (`optional`) the largest size of a batch in bytes, default is the user's
+                                remaining quota
+       :param float min_fill: (`optional`) fraction of a batch to fill before a directory is not split to fill
+                              it further
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+
+       :return: The result of `prune_request`, with the extra keys:
+
+                - **batches** (`List[Dictionary]`): the batches, each with the keys **files** (`List[string]`),
+                  **size** (`integer`, in bytes) and **directories** (`integer`, the number of directories)
+                - **too_large** (`List[string]`): files larger than a whole batch, which can not be requested
+                - **max_size** (`integer`): the largest size of a batch in bytes
+
+       :rtype: Dictionary
+    """
+    result = prune_request(files=files, patterns=patterns, client=client)
+    if max_size is None:
+        max_size = result["quota_remaining"]
+    sizes = result["sizes"]
+    by_directory = {}
+    too_large = []
+    for path in result["files"]:
+        if max_size is not None and sizes[path] > max_size:
+            too_large.append(path)
+        else:
+            by_directory.setdefault(path.rpartition("/")[0], []).append(path)
+
+    batches = []
+    batch = {"files": [], "size": 0}
+    for directory in sorted(by_directory):
+        paths = sorted(by_directory[directory])
+        dir_size = sum(sizes[p] for p in paths)
+        if max_size is not None and batch["files"] and batch["size"] + dir_size > max_size and \
+                dir_size <= max_size and batch["size"] >= min_fill * max_size:
+            batches.append(batch)
+            batch = {"files": [], "size": 0}
+        for path in paths:
+            if max_size is not None and batch["size"] + sizes[path] > max_size:
+                batches.append(batch)
+                batch = {"files": [], "size": 0}
+            batch["files"].append(path)
+            batch["size"] += sizes[path]
+    if batch["files"]:
+        batches.append(batch)
+    for batch in batches:
+        batch["directories"] = len(set(path.rpartition("/")[0] for path in batch["files"]))
+
+    result["batches"] = batches
+    result["too_large"] = too_large
+    result["max_size"] = max_size
+    return result
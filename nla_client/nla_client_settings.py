@@ -1,14 +1,138 @@
-"""Settings for the NLA system, mostly controlling whether the test version or production version is used."""
+"""Settings for the NLA system.
 
+   The server, user and TLS settings are looked up when they are first needed, rather than on import, from (in
+   order of precedence):
 
-#: set this variable to True to use a test version that uses a local disk
-#: store as an analogue for the NLA tape system
-TEST_VERSION = False
+   - an environment variable: NLA_SERVER_URL, NLA_VERIFY_CERT, NLA_USER, NLA_INDEX_FILE, NLA_HTTP_CACHE_FILE,
+     NLA_PROGRESS_DIR
+   - the [nla] section of the config file, ~/.nla_client.cfg or the file named by NLA_CONFIG, e.g.::
 
-if TEST_VERSION:
-    #: the baseurl for the api to the NLA system
-    NLA_SERVER_URL = "http://0.0.0.0:8001/nla_control"
-else:
-    NLA_SERVER_URL = "http://nla.ceda.ac.uk/nla_control"
+         [nla]
+         server_url = http://0.0.0.0:8001/nla_control
+         verify_cert = /etc/pki/tls/certs/ca-bundle.crt
 
+   - the defaults below.
+"""
+
+import os
+
+#: the baseurl for the api to the production NLA system
+NLA_SERVER_URL = "http://nla.ceda.ac.uk/nla_control"
+
+#: the baseurl for a test version of the NLA system, that uses a local disk store as an analogue for the NLA tape
+#: system.  Use it by setting server_url, e.g. NLA_SERVER_URL=http://0.0.0.0:8001/nla_control
+TEST_SERVER_URL = "http://0.0.0.0:8001/nla_control"
+
+#: verify the TLS certificate of the NLA server
 VERIFY_CERT = True
+
+#: directory for the record of the progress of each request kept by the progress command
+PROGRESS_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nla_client", "progress")
+
+#: the config file read for settings which are not in the environment
+CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".nla_client.cfg")
+
+_config = None
+
+
+def get_setting(name, default=None):
+    """Return a setting from the environment variable NLA_<NAME>, or from `name` in the [nla] section of the config
+       file, or `default` if it is in neither."""
+    global _config
+    value = os.environ.get("NLA_" + name.upper())
+    if value is not None:
+        return value
+    if _config is None:
+        from configparser import ConfigParser
+        _config = ConfigParser()
+        _config.read(os.environ.get("NLA_CONFIG", CONFIG_FILE))
+    return _config.get("nla", name, fallback=default)
+
+def server_url():
+    """The baseurl for the api to the NLA system."""
+    return get_setting("server_url", NLA_SERVER_URL)
+
+def verify_cert():
+    """Whether to verify the TLS certificate of the NLA server: True, False, or the path to a CA bundle."""
+    value = get_setting("verify_cert", VERIFY_CERT)
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    return value
+
+def quota_user():
+    """The user id of the quota to use: the NLA user setting, or the login name of the current user."""
+    value = get_setting("user") or os.environ.get("USER")
+    if not value:
+        raise RuntimeError("Cannot tell which NLA quota to use: set the USER or NLA_USER environment variable")
+    return value
+
+def index_file():
+    """SQLite file for the local index of NLA file information used by `ls` and `du`, or None if the local index
+       is not used."""
+    return get_setting("index_file")
+
+def http_cache_file():
+    """File in which the responses cached by the client are kept between runs, or None if they are only kept in
+       memory."""
+    return get_setting("http_cache_file")
+
+def progress_dir():
+    """Directory for the record of the progress of each request."""
+    return os.path.expanduser(get_setting("progress_dir", PROGRESS_DIR))
+
+#: maximum number of connections kept open to the NLA server by a client
+POOL_SIZE = 10
+
+#: timeout, in seconds, for calls to the NLA server: (connect timeout, read timeout)
+TIMEOUT = (10, 300)
+
+#: number of times a failed idempotent call (GET, PUT) is retried
+MAX_RETRIES = 3
+
+#: base, in seconds, of the jittered exponential backoff between retries
+BACKOFF_FACTOR = 0.5
+
+#: number of seconds the list of a user's requests (and quota) is reused for, to validate request ids etc.
+REQUEST_LIST_TTL = 30
+
+#: maximum number of files in each request when a listing is submitted in bulk
+CHUNK_FILES = 50000
+
+#: maximum size, in bytes, of the file list in each request when a listing is submitted in bulk
+CHUNK_BYTES = 8 * 1024 * 1024
+
+#: number of requests sent to the NLA server at once by the bulk operations
+BULK_WORKERS = 4
+
+#: most calls to the NLA server made to look up the information for a set of files
+LOOKUP_MAX_CALLS = 16
+
+#: fewest path components, e.g. 5 for /badc/cmip5/data/cmip5/output1, in the directories whose files are listed
+#: together to look up a set of files.  Directories are not merged any higher, so that the lookup never lists a
+#: whole dataset or archive, even if more than LOOKUP_MAX_CALLS calls are needed.
+LOOKUP_MIN_DEPTH = 5
+
+#: shortest time, in seconds, between polls of the NLA server when waiting for requests
+WAIT_MIN_INTERVAL = 15
+
+#: longest time, in seconds, between polls of the NLA server when waiting for requests
+WAIT_MAX_INTERVAL = 900
+
+#: longest time, in seconds, between polls while one of the requests being waited for is being restored
+WAIT_ACTIVE_INTERVAL = 120
+
+#: number of seconds that file information in the local index is used before being fetched again
+INDEX_TTL = 3600
+
+#: number of responses (e.g. the details of a request) kept by a client to check with the NLA server for changes
+HTTP_CACHE_ENTRIES = 64
+
+#: number of samples of the progress of a request that are kept, to work out the restore rate
+PROGRESS_SAMPLES = 100
+
+#: seconds over which the restore rate of a request is measured, from the samples kept
+PROGRESS_WINDOW = 3600
@@ -0,0 +1,315 @@
+"""nla_client_watch.py provides functions to follow the progress of retrieval requests in the NLA system, such as
+   waiting for requests to complete or measuring how fast they are being restored, without polling the NLA server
+   more often than needed."""
+
+import os
+import gzip
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from nla_client import nla_client_lib, nla_client_settings
+from nla_client.nla_client_plan import ON_DISK_STAGES
+from nla_client.nla_client_settings import WAIT_MIN_INTERVAL, WAIT_MAX_INTERVAL, WAIT_ACTIVE_INTERVAL, \
+    BULK_WORKERS, PROGRESS_SAMPLES, PROGRESS_WINDOW
+
+#: wait until every request has its first file on disk
+WAIT_FIRST = "first"
+#: wait until any request has its first file on disk
+WAIT_ANY = "any"
+#: wait until every request has all its files on disk
+WAIT_ALL = "all"
+#: the modes of :func:`wait_for_requests`
+WAIT_MODES = (WAIT_ALL, WAIT_FIRST, WAIT_ANY)
+
+#: the waited for condition was met
+WAIT_DONE = "done"
+#: the timeout was reached first
+WAIT_TIMEOUT = "timeout"
+#: one of the requests is not a current request of the user, e.g. it has expired
+WAIT_MISSING = "missing"
+
+def first_file_on_disk(request_info):
+    """True if the first file of a request has been restored to disk."""
+    return "first_files_on_disk" in request_info or all_files_on_disk(request_info)
+
+def all_files_on_disk(request_info):
+    """True if all the files of a request have been restored to disk."""
+    return "last_files_on_disk" in request_info or "storaged_request_end" in request_info
+
+def request_active(request_info):
+    """True if the files of a request are being restored, i.e. StorageD has started but not finished."""
+    return "storaged_request_start" in request_info and not all_files_on_disk(request_info)
+
+def wait_for_requests(request_ids, mode=WAIT_ALL, timeout=None, min_interval=None, max_interval=None,
+                      active_interval=None, callback=None, client=None):
+    """Wait for retrieval requests to reach a stage, polling the NLA server.  The state of all the requests is
+       fetched with a single call to `list_requests` each time.  The time between polls starts at `min_interval`
+       and doubles each time up to `max_interval`, or up to `active_interval` while any of the requests are being
+       restored, so that the completion of an active request is seen sooner.
+
+       :param List[integer] request_ids: the ids of the requests to wait for
+       :param string mode: (`optional`) what to wait for, one of:
+
+            - **all**: every request has all its files on disk (default)
+            - **first**: every request has its first file on disk
+            - **any**: any of the requests has its first file on disk
+
+       :param float timeout: (`optional`) give up after this many seconds, default is to wait indefinitely
+       :param float min_interval: (`optional`) shortest time between polls, in seconds
+       :param float max_interval: (`optional`) longest time between polls, in seconds
+       :param float active_interval: (`optional`) longest time between polls while any request is active
+       :param callback: (`optional`) function called with the Dictionary of request information for each id
+                        after every poll
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+
+       :return: A tuple of the outcome, one of "done", "timeout" or "missing", and a Dictionary mapping each request
+                id to the last information fetched for it (as in the "requests" list of `list_requests`), or None
+                if it is not one of the user's current requests.
+       :rtype: Tuple
+       :raises ValueError: if `mode` is not one of the above
+    """
+    tests = {WAIT_ALL: all_files_on_disk, WAIT_FIRST: first_file_on_disk, WAIT_ANY: first_file_on_disk}
+    if mode not in tests:
+        raise ValueError("Unknown wait mode %r: should be one of %s" % (mode, ", ".join(WAIT_MODES)))
+    test = tests[mode]
+    client = client or nla_client_lib.get_client()
+    min_interval = min_interval or WAIT_MIN_INTERVAL
+    max_interval = max_interval or WAIT_MAX_INTERVAL
+    active_interval = active_interval or WAIT_ACTIVE_INTERVAL
+    combine = any if mode == WAIT_ANY else all
+    request_ids = [int(i) for i in request_ids]
+
+    deadline = None if timeout is None else time.time() + timeout
+    interval = min_interval
+    was_active = set()
+    while True:
+        quota = client.list_requests(max_age=0)
+        if quota is None:
+            raise IOError("Could not fetch the list of requests for %s" % client.user)
+        current = dict((req["id"], req) for req in quota["requests"])
+        requests = dict((i, current.get(i)) for i in request_ids)
+        if callback is not None:
+            callback(requests)
+        if any(r is None for r in requests.values()):
+            return WAIT_MISSING, requests
+        if combine(test(r) for r in requests.values()):
+            return WAIT_DONE, requests
+
+        active = set(i for i, r in requests.items() if request_active(r))
+        if active - was_active:
+            # a request has just started restoring - poll more often again
+            interval = min_interval
+        was_active = active
+        limit = active_interval if active else max_interval
+        sleep = min(interval, limit)
+        if deadline is not None:
+            if time.time() >= deadline:
+                return WAIT_TIMEOUT, requests
+            sleep = min(sleep, max(deadline - time.time(), 0))
+        time.sleep(sleep)
+        interval = min(interval * 2, limit)
+
+def iter_restored(request_id, min_interval=None, max_interval=None, timeout=None, client=None):
+    """Yield the files of a retrieval request as each one is restored to disk (reaches stage **R**), so that they
+       can be processed while the rest of the request is still being restored from tape.  Files which are
+       already on disk (stages **U**, **D** and **R**) are yielded first.  Each file is yielded once.  Only the
+       files which have not been restored yet are looked up each time, with :func:`nla_client_lib.lookup_files`,
+       which lists neighbouring directories together in a few calls.  The time between polls doubles from
+       `min_interval` to `max_interval`, and goes back to `min_interval` whenever new files are found.
+
+       The iteration stops when all the files have been restored, or when the request is complete but some files
+       are still not restored (e.g. they could not be read from tape), or when `timeout` is reached.
+
+       :param integer request_id: the id of the request
+       :param float min_interval: (`optional`) shortest time between polls, in seconds
+       :param float max_interval: (`optional`) longest time between polls, in seconds
+       :param float timeout: (`optional`) stop after this many seconds, default is to wait indefinitely
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+
+       :return: An iterator over the logical paths of the restored files
+       :rtype: Iterator[string]
+    """
+    client = client or nla_client_lib.get_client()
+    min_interval = min_interval or WAIT_MIN_INTERVAL
+    max_interval = max_interval or WAIT_MAX_INTERVAL
+    request_info = client.show_request(request_id)
+    if request_info is None:
+        raise ValueError("%s is not a request in the NLA system" % request_id)
+
+    pending = set(request_info.get("files", []))
+    deadline = None if timeout is None else time.time() + timeout
+    interval = min_interval
+    complete = all_files_on_disk(request_info)
+    # files already on disk when the request was made are never restored, so only look for them the first time
+    stages = ON_DISK_STAGES
+    while pending:
+        restored = client.lookup_files(pending, stages=stages)
+        stages = "R"
+        for path in restored:
+            pending.discard(path)
+            yield path
+        if not pending or (complete and not restored):
+            return
+        if restored:
+            interval = min_interval
+        if deadline is not None and time.time() + interval > deadline:
+            return
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+        if not complete:
+            # once StorageD has finished, one more look for files is all that is needed.  The status is taken from
+            # the request list, which does not include the (possibly long) list of files in each request.
+            quota = client.list_requests(max_age=0)
+            if quota is not None:
+                current = [r for r in quota["requests"] if r["id"] == request_info["id"]]
+                complete = not current or all_files_on_disk(current[0])
+
+def process_restored(request_id, callback, workers=None, **kwargs):
+    """Call `callback` for each file of a retrieval request as soon as it is restored to disk, using a pool of
+       threads so that processing overlaps with the restore of the rest of the request.  At most `workers` calls
+       run at once, and at most twice that many restored files are waiting for a free worker.
+
+       :param integer request_id: the id of the request
+       :param callback: function called with the logical path of each restored file
+       :param integer workers: (`optional`) number of calls to `callback` to run at once
+       :param kwargs: other arguments are passed to :func:`iter_restored`
+
+       :return: A tuple of two Dictionaries: the value returned by `callback` for each path it succeeded for, and
+                the exception raised for each path it failed for
+       :rtype: Tuple
+    """
+    workers = workers or BULK_WORKERS
+    slots = threading.BoundedSemaphore(2 * workers)
+    results = {}
+    errors = {}
+
+    def run(path):
+        try:
+            results[path] = callback(path)
+        except Exception as e:
+            errors[path] = e
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path in iter_restored(request_id, **kwargs):
+            slots.acquire()
+            executor.submit(run, path)
+    return results, errors
+
+def _progress_file(request_id, client, state_dir=None):
+    return os.path.join(state_dir or nla_client_settings.progress_dir(), "%s_%s.json.gz" % (client.user, request_id))
+
+def _load_progress(filename):
+    try:
+        with gzip.open(filename, "rt") as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError, EOFError):
+        return None
+
+def _save_progress(filename, state):
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = "%s.%i.tmp" % (filename, os.getpid())
+    with gzip.open(tmp, "wt") as fh:
+        json.dump(state, fh)
+    os.rename(tmp, filename)
+
+def request_progress(request_id, state_dir=None, save=True, quota=None, client=None):
+    """Measure how much of a retrieval request has been restored to disk, and how fast it is being restored.
+
+       The first time, the whole file list of the request is fetched and the stage and size of every file looked
+       up.  The files not yet on disk, and a sample of the number of files and bytes on disk, are recorded in a
+       file in `state_dir`.  After that, only the files not yet on disk are looked up (with
+       :func:`nla_client_lib.lookup_files`) and a new sample is added, so each call costs less as the request is
+       restored.  The rate is worked out from the samples over the last PROGRESS_WINDOW seconds.
+
+       :param integer request_id: the id of the request
+       :param string state_dir: (`optional`) directory for the record of the progress, default from the
+                                progress_dir setting
+       :param bool save: (`optional`) record this sample, for the next call
+       :param Dictionary quota: (`optional`) the user's request list, as returned by `list_requests`, to take the
+                                status of the request from.  Pass it when measuring several requests, so that the
+                                list is fetched once.  By default it is fetched from the server.
+       :param NLAClient client: (`optional`) the client to use, default is the shared client
+
+       :return: A dictionary with the keys:
+
+                - **id** (`integer`): the request id
+                - **status** (`string`): "queued", "active", "complete" or "expired"
+                - **files**, **bytes** (`integer`): number and total size of the files in the request
+                - **restored_files**, **restored_bytes** (`integer`): number and total size of the files on disk
+                - **missing** (`integer`): number of files in the request which are not in the NLA system
+                - **files_per_second**, **bytes_per_second** (`float`): restore rate, or None if not known yet
+                - **eta** (`float`): seconds until the request is restored at this rate, or None if not known
+
+       :rtype: Dictionary
+    """
+    client = client or nla_client_lib.get_client()
+    filename = _progress_file(request_id, client, state_dir)
+    state = _load_progress(filename)
+    now = time.time()
+
+    if quota is None:
+        quota = client.list_requests(max_age=0)
+    current = [r for r in quota["requests"] if r["id"] == int(request_id)] if quota is not None else []
+    if not current:
+        status = "expired"
+    elif all_files_on_disk(current[0]):
+        status = "complete"
+    elif request_active(current[0]):
+        status = "active"
+    else:
+        status = "queued"
+
+    if state is None or state.get("id") != int(request_id):
+        request_info = client.show_request(request_id)
+        if request_info is None:
+            raise ValueError("%s is not a request in the NLA system" % request_id)
+        paths = request_info.get("files", [])
+        found = client.lookup_files(paths)
+        state = {"id": int(request_id), "files": len(found), "bytes": 0, "restored_files": 0, "restored_bytes": 0,
+                 "missing": len(paths) - len(found), "pending": [], "samples": []}
+        for path, f in found.items():
+            size = int(f.get("size") or 0)
+            state["bytes"] += size
+            if f["stage"] in ON_DISK_STAGES:
+                state["restored_files"] += 1
+                state["restored_bytes"] += size
+            else:
+                state["pending"].append(path)
+    elif state["pending"] and status != "expired":
+        restored = client.lookup_files(state["pending"], stages="R")
+        if restored:
+            for f in restored.values():
+                state["restored_files"] += 1
+                state["restored_bytes"] += int(f.get("size") or 0)
+            state["pending"] = [path for path in state["pending"] if path not in restored]
+
+    samples = state["samples"]
+    samples.append([now, state["restored_files"], state["restored_bytes"]])
+    del samples[:-PROGRESS_SAMPLES]
+    if save:
+        _save_progress(filename, state)
+
+    # the rate since the oldest sample in the window, or the one before it if that is the only one
+    files_rate = bytes_rate = eta = None
+    window = [sample for sample in samples if sample[0] >= now - PROGRESS_WINDOW]
+    if len(window) < 2 and len(samples) >= 2:
+        window = samples[-2:]
+    if len(window) >= 2 and window[-1][0] > window[0][0]:
+        elapsed = window[-1][0] - window[0][0]
+        files_rate = (window[-1][1] - window[0][1]) / elapsed
+        bytes_rate = (window[-1][2] - window[0][2]) / elapsed
+        remaining = state["bytes"] - state["restored_bytes"]
+        if not state["pending"]:
+            eta = 0.0
+        elif bytes_rate > 0:
+            eta = remaining / bytes_rate
+    return {"id": state["id"], "status": status, "files": state["files"], "bytes": state["bytes"],
+            "restored_files": state["restored_files"], "restored_bytes": state["restored_bytes"],
+            "missing": state["missing"], "files_per_second": files_rate, "bytes_per_second": bytes_rate,
+            "eta": eta}
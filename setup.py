@@ -14,6 +14,10 @@ setup(
     install_requires=['requests',
                       'python_dateutil',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'numpy': ['numpy'],
+    },
     include_package_data=True,
     license='BSD License',  # example license
     description='A command line client to access the near-line archive (NLA) on JASMIN.',
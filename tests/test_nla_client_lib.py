@@ -0,0 +1,51 @@
+"""Tests for the streaming JSON decoder in nla_client_lib.py, which needs no NLA server."""
+
+import json
+import random
+
+import pytest
+
+from nla_client.nla_client_lib import _iter_json_array
+
+
+def split(text, rng, max_size):
+    """Split text into chunks of random sizes from 1 to max_size characters."""
+    chunks = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, max_size)
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+def documents(rng):
+    files = [{"path": "/badc/mock/data/a/2015/12/%02i/mock_%08i.nc" % (n % 31 + 1, n),
+              "stage": rng.choice("UDTAR"), "size": rng.randint(0, 2 ** 40),
+              "verified": None if n % 7 else "2015-12-04T10:00:00"} for n in range(50)]
+    yield {"count": len(files), "files": files}
+    yield {"files": [1, 22, 333, -4.5, 1.5e3, 0, 7e-3, True, False, None, "x", [], {}, [1, [2]]]}
+    yield {"files": []}
+    yield {"meta": {"files": ["x"]}, "files": [1, 2]}
+    yield {"note": "a string with \"files\": [3] and \\ in it", "files": ["\"quoted\"", "\\", "café"]}
+    yield {"requests": [{"files": [9]}], "user": "tester", "files": [{"files": [8]}]}
+
+def test_items_in_random_chunks():
+    rng = random.Random(1)
+    for document in documents(rng):
+        for indent in (None, 2):
+            text = json.dumps(document, indent=indent)
+            for max_size in (1, 2, 3, 7, 64, len(text)):
+                for _ in range(5):
+                    assert list(_iter_json_array(split(text, rng, max_size), "files")) == document["files"]
+
+def test_nested_list_of_the_same_name_is_skipped():
+    text = '{"meta": {"files": ["x"]}, "files": [1, 2]}'
+    assert list(_iter_json_array([text], "files")) == [1, 2]
+
+def test_missing_list():
+    assert list(_iter_json_array(['{"count": 0, "meta": {"files": [1]}}'], "files")) == []
+
+def test_truncated_document():
+    text = json.dumps({"files": [1, 2, 3]})
+    with pytest.raises(ValueError):
+        list(_iter_json_array(split(text[:-3], random.Random(2), 3), "files"))
@@ -0,0 +1,58 @@
+"""Tests for the pattern matching in nla_client_match.py, which needs no NLA server."""
+
+import re
+import random
+
+from nla_client.nla_client_match import _regex_literal, _glob_literal, Pattern, Automaton, MultiMatcher
+
+
+def test_regex_literal():
+    assert _regex_literal(r"mock_0+12\.nc") == "mock_0"
+    assert _regex_literal(r"abc?d") == "ab"
+    assert _regex_literal(r"\d{4}/12/31") == "/12/31"
+    assert _regex_literal(r"_(01|02)\.nc$") == ".nc"
+    assert _regex_literal(r"data/a/20(15|16)/12/0\d/mock") == "data/a/20"
+    assert _regex_literal(r"(x|y)?abc") == "abc"
+    assert _regex_literal(r"a|bcd") == ""
+
+def test_regex_literal_is_in_every_match():
+    paths = ["/badc/mock/data/a/2015/12/%02i/mock_%08i.nc" % (day, n) for day in range(1, 32) for n in (7, 12, 17)]
+    for regex in (r"mock_0+12\.nc", r"2015/12/0\d", r"/(a|b)/2015/", r"_0*1[27]\.nc$"):
+        literal = _regex_literal(regex)
+        for path in paths:
+            if re.search(regex, path):
+                assert literal in path
+
+def test_flagged_regex_has_no_literal():
+    for text in ("re:(?i)station", "re:(?i:station)_01", "re:(?x) station _ 01"):
+        pattern = Pattern(text)
+        assert pattern.literal == ""
+    matcher = MultiMatcher(["re:(?i)station"])
+    assert matcher.match("/x/STATION/y.nc") == [0]
+    assert matcher.server_filter() == ""
+
+def test_non_capturing_group_keeps_literal():
+    assert Pattern(r"re:(?:a|b)/station_01").literal == "/station_01"
+
+def test_glob_literal():
+    assert _glob_literal("*/2016/12/0[1-5]/*.nc") == "/2016/12/0"
+
+def test_automaton():
+    words = ["he", "she", "his", "hers", "e", "s", "ab", "b", "bab"]
+    automaton = Automaton()
+    for n, word in enumerate(words):
+        automaton.add(word, n)
+    automaton.build()
+    rng = random.Random(1)
+    for _ in range(1000):
+        text = "".join(rng.choice("hersiab") for _ in range(12))
+        assert automaton.find(text) == set(n for n, word in enumerate(words) if word in text)
+
+def test_multi_matcher():
+    matcher = MultiMatcher(["2015/12/04", "2015/12/05", "*/2016/12/0[1-5]/*", r"re:2014/12/31/.*7\.nc$"])
+    assert matcher.match("/badc/a/2016/12/03/mock_1.nc") == [2]
+    assert matcher.match("/x/2015/12/05/y") == [1]
+    assert matcher.match("/x/2014/12/31/7.nc") == [3]
+    assert matcher.match("/x/2014/12/31/8.nc") == []
+    assert matcher.server_filter() == "/12/"
+    assert MultiMatcher(["2015/12/04", "2015/12/05"]).server_filter() == "2015/12/0"